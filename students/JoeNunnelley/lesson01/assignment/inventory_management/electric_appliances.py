@@ -8,6 +8,8 @@ from inventory import Inventory
 
 class ElectricAppliances(Inventory):
     """ The ElectricAppliances class """
+    __slots__ = ('brand', 'voltage')
+
     def __init__(self, product_code, description, market_price,
                  rental_price, brand, voltage):
         """ Creates common instance variables from the parent class """
@@ -8,6 +8,8 @@ from inventory import Inventory
 
 class Furniture(Inventory):
     """ The Furniture Class """
+    __slots__ = ('material', 'size')
+
     def __init__(self, product_code, description, market_price,
                  rental_price, material, size):
         # Creates common instance variables from the parent class
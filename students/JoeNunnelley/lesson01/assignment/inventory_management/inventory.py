@@ -6,6 +6,9 @@ The Inventory Module
 
 class Inventory:
     """ The InventoryItem Class """
+    __slots__ = ('product_code', 'description', 'market_price',
+                 'rental_price')
+
     def __init__(self, product_code, description, market_price, rental_price):
         self.product_code = product_code
         self.description = description
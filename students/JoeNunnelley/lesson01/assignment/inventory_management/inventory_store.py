@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+"""
+Inventory Store Module : the indexed, in memory inventory
+
+Items are kept as the Inventory, Furniture and ElectricAppliances objects
+themselves, keyed by product code. Secondary indexes map description
+words, furniture materials and appliance brands to product codes and keep
+the market prices sorted, so searches and price ranges do not scan every
+item.
+"""
+
+import bisect
+import re
+
+
+def tokens(text):
+    """ The lower case words of a text """
+    return set(re.findall(r'\w+', str(text).lower()))
+
+
+def price_of(entry):
+    """ The price of a (price, product code) price index entry """
+    return entry[0]
+
+
+class InventoryStore:
+    """ The InventoryStore Class """
+    def __init__(self, items=()):
+        self._items = {}
+        self._words = {}
+        self._materials = {}
+        self._brands = {}
+        # Sorted (price, product code) pairs. Pairs of added items wait in
+        # _pending and those of removed items are counted in _stale until
+        # the next price query brings _prices up to date.
+        self._prices = []
+        self._pending = []
+        self._stale = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, product_code):
+        return product_code in self._items
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __getitem__(self, product_code):
+        return self._items[product_code]
+
+    def __repr__(self):
+        items = {code: item.return_as_dictionary()
+                 for code, item in self._items.items()}
+        return f'{type(self).__name__}({items!r})'
+
+    def keys(self):
+        """ The product codes in the store """
+        return self._items.keys()
+
+    def get(self, product_code, default=None):
+        """ The item with product_code, or default when there is none """
+        return self._items.get(product_code, default)
+
+    def add(self, item):
+        """ Add an item to the store, replacing any with the same code """
+        code = item.product_code
+        price = float(item.market_price)
+        if code in self._items:
+            self.remove(code)
+        self._items[code] = item
+        for word in tokens(item.description):
+            self._words.setdefault(word, set()).add(code)
+        for index, value in self._indexed_values(item):
+            index.setdefault(value, set()).add(code)
+        self._pending.append((price, code))
+
+    def remove(self, product_code):
+        """ Remove and return the item with product_code """
+        item = self._items.pop(product_code)
+        for word in tokens(item.description):
+            self._discard(self._words, word, product_code)
+        for index, value in self._indexed_values(item):
+            self._discard(index, value, product_code)
+        entry = (float(item.market_price), product_code)
+        self._stale[entry] = self._stale.get(entry, 0) + 1
+        if len(self._prices) + len(self._pending) > 2 * len(self) + 64:
+            # replaced over and over without a query in between
+            self._tidy_prices()
+        return item
+
+    def search(self, text):
+        """ The items whose description has every word of text """
+        sets = sorted((self._words.get(word, set()) for word in tokens(text)),
+                      key=len)
+        if not sets:
+            return []
+        codes = sets[0].intersection(*sets[1:])
+        return [self._items[code] for code in sorted(codes)]
+
+    def by_material(self, material):
+        """ The furniture made of material, ignoring case """
+        return self._lookup(self._materials, material)
+
+    def by_brand(self, brand):
+        """ The electric appliances of brand, ignoring case """
+        return self._lookup(self._brands, brand)
+
+    def price_range(self, low=None, high=None):
+        """ The items with market prices from low to high, cheapest first """
+        self._tidy_prices()
+        start = 0
+        end = len(self._prices)
+        if low is not None:
+            start = bisect.bisect_left(self._prices, float(low), key=price_of)
+        if high is not None:
+            end = bisect.bisect_right(self._prices, float(high),
+                                      key=price_of)
+        return [self._items[code] for _, code in self._prices[start:end]]
+
+    def _indexed_values(self, item):
+        """ (index, key) of the material or brand index entries of item """
+        entries = []
+        material = getattr(item, 'material', None)
+        if material is not None:
+            entries.append((self._materials, str(material).lower()))
+        brand = getattr(item, 'brand', None)
+        if brand is not None:
+            entries.append((self._brands, str(brand).lower()))
+        return entries
+
+    def _lookup(self, index, value):
+        """ The items under value in a material or brand index """
+        codes = index.get(str(value).lower(), set())
+        return [self._items[code] for code in sorted(codes)]
+
+    def _tidy_prices(self):
+        """ Add the pending pairs to the price index, drop the stale ones """
+        if len(self._pending) * 64 < len(self._prices):
+            # a few additions, bisect them in where they belong
+            for entry in self._pending:
+                bisect.insort(self._prices, entry)
+        else:
+            self._prices.extend(self._pending)
+            self._prices.sort()
+        self._pending = []
+        if not self._stale:
+            return
+        if len(self._stale) * 64 < len(self._prices):
+            # a few removals, cut them out where they sit
+            for entry, count in self._stale.items():
+                start = bisect.bisect_left(self._prices, entry)
+                del self._prices[start:start + count]
+        else:
+            stale = self._stale
+            kept = []
+            for entry in self._prices:
+                if stale.get(entry):
+                    stale[entry] -= 1
+                else:
+                    kept.append(entry)
+            self._prices = kept
+        self._stale = {}
+
+    @staticmethod
+    def _discard(index, key, product_code):
+        """ Remove product_code from index[key], dropping empty keys """
+        codes = index.get(key)
+        if codes is not None:
+            codes.discard(product_code)
+            if not codes:
+                del index[key]
@@ -9,8 +9,9 @@ import electric_appliances as e_app
 import furniture as fur
 import inventory as inv
 import market_prices as pri
+from inventory_store import InventoryStore
 
-FULL_INVENTORY = {}
+FULL_INVENTORY = InventoryStore()
 
 
 def main_menu(user_prompt=None):
@@ -60,7 +61,7 @@ def add_new_item():
         else:
             new_item = inv.Inventory(item_code, item_description, item_price,
                                      item_rental_price)
-    FULL_INVENTORY[item_code] = new_item.return_as_dictionary()
+    FULL_INVENTORY.add(new_item)
     print("New inventory item added")
 
 
@@ -68,7 +69,7 @@ def item_info():
     """ Output th item information """
     item_code = input("Enter item code: ")
     if item_code in FULL_INVENTORY:
-        print_dict = FULL_INVENTORY[item_code]
+        print_dict = FULL_INVENTORY[item_code].return_as_dictionary()
         for key, value in print_dict.items():
             print("{}:{}".format(key, value))
     else:
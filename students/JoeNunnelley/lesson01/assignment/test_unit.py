@@ -9,6 +9,7 @@ from unittest.mock import patch
 from inventory_management.inventory import Inventory
 from inventory_management.furniture import Furniture
 from inventory_management.electric_appliances import ElectricAppliances
+from inventory_management.inventory_store import InventoryStore
 import inventory_management.main as main
 import inventory_management.market_prices as market_prices
 
@@ -69,6 +70,94 @@ class TestElectricalApplianceClass(TestCase):
         assert item_dict['Voltage'] == 120
 
 
+# Tests for inventory store module
+class TestInventoryStoreClass(TestCase):
+    """ Class for testing the indexed inventory store """
+    def setUp(self):
+        """ Stock a store with one item of each type """
+        self.store = InventoryStore(
+            [Inventory('CORN', 'The plant corn', 30, 0),
+             Furniture('SOFA', 'A place to sit', 300, 50, 'Cloth', 'L'),
+             Furniture('CHAIR', 'A wooden place to sit', 40, 5, 'Wood', 'M'),
+             ElectricAppliances('VCR', 'What you watch Betamax on', 3, 0,
+                                'Panasonic', 120)])
+
+    def codes(self, items):
+        """ The product codes of a list of items """
+        return [item.product_code for item in items]
+
+    def test_lookup(self):
+        """ Items are found by code and hold no instance dictionary """
+        self.assertEqual(len(self.store), 4)
+        self.assertIn('SOFA', self.store)
+        self.assertEqual(self.store['SOFA'].material, 'Cloth')
+        self.assertIsNone(self.store.get('WHEAT'))
+        self.assertFalse(hasattr(self.store['VCR'], '__dict__'))
+
+    def test_secondary_indexes(self):
+        """ Description words, material and brand find the right items """
+        self.assertEqual(self.codes(self.store.search('place to SIT')),
+                         ['CHAIR', 'SOFA'])
+        self.assertEqual(self.codes(self.store.search('wooden sit')),
+                         ['CHAIR'])
+        self.assertEqual(self.store.search('table'), [])
+        self.assertEqual(self.codes(self.store.by_material('wood')),
+                         ['CHAIR'])
+        self.assertEqual(self.codes(self.store.by_brand('PANASONIC')),
+                         ['VCR'])
+
+    def test_price_range(self):
+        """ Price ranges are inclusive and cheapest first """
+        self.assertEqual(self.codes(self.store.price_range(30, 300)),
+                         ['CORN', 'CHAIR', 'SOFA'])
+        self.assertEqual(self.codes(self.store.price_range(high=30)),
+                         ['VCR', 'CORN'])
+        self.assertEqual(self.codes(self.store.price_range(low=301)), [])
+
+    def test_replace_and_remove(self):
+        """ Replaced and removed items leave every index """
+        self.store.add(Furniture('SOFA', 'A big bed', 10, 1, 'Leather', 'XL'))
+        self.assertEqual(self.codes(self.store.search('sit')), ['CHAIR'])
+        self.assertEqual(self.store.by_material('cloth'), [])
+        self.assertEqual(self.codes(self.store.price_range(high=10)),
+                         ['VCR', 'SOFA'])
+        self.assertEqual(self.store.remove('VCR').brand, 'Panasonic')
+        self.assertEqual(self.store.by_brand('panasonic'), [])
+        self.assertEqual(self.codes(self.store.price_range()),
+                         ['SOFA', 'CORN', 'CHAIR'])
+        with self.assertRaises(KeyError):
+            self.store.remove('VCR')
+
+    def test_many_replacements(self):
+        """ Replacing items over and over keeps the price index right """
+        for number in range(3000):
+            self.store.add(Inventory('CORN', 'The plant corn',
+                                     number % 500, 0))
+            self.store.add(Inventory(f'SEED{number % 50}', 'A seed',
+                                     number % 7, 0))
+            if number % 1000 == 999:
+                self.assertEqual(
+                    self.codes(self.store.price_range(499, 499)), ['CORN'])
+        self.assertEqual(len(self.store), 54)
+        self.assertEqual(len(self.store.price_range()), 54)
+        self.assertEqual(self.codes(self.store.price_range(300)),
+                         ['SOFA', 'CORN'])
+
+    def test_bad_replacement(self):
+        """ A replacement without a usable price keeps the old item """
+        corn = self.store['CORN']
+        with self.assertRaises(ValueError):
+            self.store.add(Inventory('CORN', 'The plant corn', 'cheap', 0))
+        self.assertIs(self.store['CORN'], corn)
+        self.assertEqual(self.codes(self.store.search('corn')), ['CORN'])
+        self.assertIn(corn, self.store.price_range())
+
+    def test_repr(self):
+        """ A store shows its items as dictionaries """
+        self.assertIn("'VCR': {'productCode': 'VCR'", repr(self.store))
+        self.assertTrue(repr(self.store).startswith('InventoryStore({'))
+
+
 # Tests for main
 class TestMainClass(TestCase):
     """ Class for testing the main interface """
@@ -98,14 +187,9 @@ class TestMainClass(TestCase):
         the correct value.  This patches get_latest_prices since the method
         implementation is not functional
         """
-        main.FULL_INVENTORY = {'CORN': {'product_code': 'CORN',
-                                        'description': 'This is corn',
-                                        'market_price': 24,
-                                        'rental_price': 50},
-                               'WATER': {'product_code': 'WATER',
-                                         'description': 'This is water',
-                                         'market_price': 40,
-                                         'rental_price': 0,}}
+        main.FULL_INVENTORY = InventoryStore(
+            [Inventory('CORN', 'This is corn', 24, 50),
+             Inventory('WATER', 'This is water', 40, 0)])
 
         assert main.get_price('CORN') == 24
 
@@ -125,7 +209,7 @@ class TestMainClass(TestCase):
     @classmethod
     def test_item_add_furniture(cls):
         """ Test to validate the addition of a furniture entry to the inventory """
-        main.FULL_INVENTORY = {}
+        main.FULL_INVENTORY = InventoryStore()
         user_inputs = ['CHAIR', 'This is a chair', 30, 'Y', 'wood', 'L']
         with patch('builtins.input', side_effect=user_inputs):
             main.add_new_item()
@@ -139,7 +223,7 @@ class TestMainClass(TestCase):
         Test to validate the addition of a electrical appliance entry
         to the inventory
         """
-        main.FULL_INVENTORY = {}
+        main.FULL_INVENTORY = InventoryStore()
         user_inputs = ['TV', 'This is a tv', 300, 'N', 'Y', 'metal', 'S']
         with patch('builtins.input', side_effect=user_inputs):
             main.add_new_item()
@@ -150,7 +234,7 @@ class TestMainClass(TestCase):
     @classmethod
     def test_item_add_standard(cls):
         """ Test to validate the addition of a standard entry to the inventory """
-        main.FULL_INVENTORY = {}
+        main.FULL_INVENTORY = InventoryStore()
         user_inputs = ['CORN', 'This is corn', 30, 'N', 'n']
         with patch('builtins.input', side_effect=user_inputs):
             main.add_new_item()
@@ -164,14 +248,9 @@ class TestMainClass(TestCase):
         Test to validate that an item can be found when it exists
         in the inventory
         """
-        main.FULL_INVENTORY = {'CORN': {'product_code': 'CORN',
-                                        'description': 'This is corn',
-                                        'market_price': 24,
-                                        'rental_price': 50},
-                               'WATER': {'product_code': 'WATER',
-                                         'description': 'This is water',
-                                         'market_price': 40,
-                                         'rental_price': 0,}}
+        main.FULL_INVENTORY = InventoryStore(
+            [Inventory('CORN', 'This is corn', 24, 50),
+             Inventory('WATER', 'This is water', 40, 0)])
 
         with patch('builtins.input', side_effect='CORN'):
             with patch('sys.stdout', new=io.StringIO()) as actual_result:
@@ -190,14 +269,9 @@ class TestMainClass(TestCase):
         Test to validate that an item not found when it doesn't exist
         in the inventory returns the correct message
         """
-        main.FULL_INVENTORY = {'CORN': {'product_code': 'CORN',
-                                        'description': 'This is corn',
-                                        'market_price': 24,
-                                        'rental_price': 50},
-                               'WATER': {'product_code': 'WATER',
-                                         'description': 'This is water',
-                                         'market_price': 40,
-                                         'rental_price': 0,}}
+        main.FULL_INVENTORY = InventoryStore(
+            [Inventory('CORN', 'This is corn', 24, 50),
+             Inventory('WATER', 'This is water', 40, 0)])
 
         with patch('builtins.input', side_effect='WHEAT'):
             with patch('sys.stdout', new=io.StringIO()) as actual_result:
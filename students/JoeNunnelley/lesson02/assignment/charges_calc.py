@@ -4,24 +4,59 @@
 Returns total price paid for individual rentals
 """
 import argparse
+import collections
 import datetime
+import functools
+import itertools
 import json
 import logging
+import marshal
 import math
-
+import multiprocessing as mp
+import os
+import re
+import rental_columns
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
 
 LOGGER = logging.getLogger()
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+DATE_PATTERN = re.compile(r'(\d{1,2})/(\d{1,2})/(\d\d)')
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+OPEN_PATTERN = re.compile(r'[ \t\n\r]*{[ \t\n\r]*(}?)')
+KEY_PATTERN = re.compile(r'("(?:[^"\\]|\\.)*")[ \t\n\r]*:[ \t\n\r]*')
+NEXT_PATTERN = re.compile(r'[ \t\n\r]*([,}])[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+READ_SIZE = 64 * 1024
+CHUNK_SIZE = 5000
+CACHE_VERSION = 2
+# The fields derive_fields() adds
+DERIVED_FIELDS = ('total_days', 'total_price', 'sqrt_total_price',
+                  'unit_cost')
+# The rejection_reasons() messages, the columnar masks hold their indexes
+MISSING_CHECKS = (None, 'missing price_per_day', 'missing product code',
+                  'missing rental_start value', 'missing rental_end value',
+                  'missing units_rented value')
+INVALID_CHECKS = (None, 'invalid price_per_day', 'invalid rental dates',
+                  'invalid units_rented value', 'unreadable rental dates')
+# Lays out a flat dict the way indent=2 does one level down, but is run
+# by the C encoder, which is only used when indent is None.
+RECORD_ENCODER = json.JSONEncoder(separators=(',\n    ', ': '))
 
 
 def setup_logging(_log_level=None):
     """
-        Accepts None (no -d sent in) and 1 - 3.
+        Accepts None (no -d sent in) and 1 - 4.
         All other values are invalid including 0
         None: No debug messages or log file.
         1: Only error messages.
         2: Error messages and warnings.
         3: Error messages, warnings and debug messages.
-        *  No debug message to logfile
+        4: Error messages, warnings, debug and trace messages.
+        *  No debug or trace message to logfile
     """
     log_level = logging.INFO
     if _log_level is None:
@@ -36,8 +71,11 @@ def setup_logging(_log_level=None):
     elif int(_log_level) == 3:
         print('Error, Warning and Debug message logging')
         log_level = logging.DEBUG
+    elif int(_log_level) == 4:
+        print('Error, Warning, Debug and Trace message logging')
+        log_level = TRACE
     else:
-        print("Invalid log_level. Expected values 1 - 3. "
+        print("Invalid log_level. Expected values 1 - 4. "
               "This argument is optional.")
         exit(1)
 
@@ -49,7 +87,7 @@ def setup_logging(_log_level=None):
         file_handler = logging.FileHandler(log_file, mode='w')
 
         # We don't want to log DEBUG messages to the log file
-        if log_level == logging.DEBUG:
+        if log_level <= logging.DEBUG:
             file_handler.setLevel(logging.WARNING)
         else:
             file_handler.setLevel(log_level)
@@ -72,15 +110,42 @@ def parse_cmd_arguments():
                         required=True)
     parser.add_argument('-o',
                         '--output',
-                        help='ouput JSON file',
+                        help='ouput JSON file, or columnar .npz file',
                         required=True)
 
     parser.add_argument('-d',
                         '--debug',
-                        help='set the log output level (1-3)',
+                        help='set the log output level (1-4)',
                         required=False)
+    parser.add_argument('-n',
+                        '--sample',
+                        help='only write the debug line of every Nth rental',
+                        type=int,
+                        default=1)
+    parser.add_argument('-s',
+                        '--stream',
+                        help='process the rentals one at a time instead of '
+                             'loading the whole file',
+                        action='store_true')
+    parser.add_argument('-c',
+                        '--columnar',
+                        help='compute the new fields as numpy columns',
+                        action='store_true')
+    parser.add_argument('-k',
+                        '--cache',
+                        help='cache file of earlier results, only new or '
+                             'changed rentals are recomputed')
+    parser.add_argument('-w',
+                        '--workers',
+                        help='number of processes enriching the rentals',
+                        type=int,
+                        default=1)
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if args.cache and (args.workers > 1 or args.columnar or args.stream):
+        parser.error('--cache only works with a single worker and without '
+                     '--columnar or --stream')
+    return args
 
 
 def load_rentals_file(filename):
@@ -94,100 +159,550 @@ def load_rentals_file(filename):
     return data
 
 
-def calculate_additional_fields(data):
-    """ this function creates secondary data points from the primary ones """
-    cleaned_data = {}
-    for key, value in data.items():
+class RentalStream:  # pylint: disable=too-few-public-methods
+    """
+    Incremental reader for a {"RNT001": {...}, ...} rentals file.
+
+    Iterating yields (rental_id, rental) pairs one at a time, so only the
+    current rental and one read buffer are ever held in memory.
+    """
+    def __init__(self, file, read_size=READ_SIZE):
+        self.file = file
+        self.read_size = read_size
+        self.buffer = ''
+        self.position = 0
+
+    def _more(self):
+        """ Drop the consumed text and read the next chunk of the file """
+        chunk = self.file.read(self.read_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def _match(self, pattern, expecting):
+        """ Consume the text matching pattern and return the match """
+        while True:
+            match = pattern.match(self.buffer, self.position)
+            # A match running up to the end of the buffer might have been
+            # longer with the next chunk, so read on before trusting it.
+            if match and match.end() < len(self.buffer):
+                break
+            if not self._more():
+                if match:
+                    break
+                raise json.JSONDecodeError(f"Expecting {expecting}",
+                                           self.buffer, self.position)
+        self.position = match.end()
+        return match
+
+    def _value(self):
+        """ Decode the complete JSON value at the current position """
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                # Most likely the value runs past the end of the buffer
+                if self._more():
+                    continue
+                raise
+            if end < len(self.buffer) or not self._more():
+                self.position = end
+                return value
+
+    def __iter__(self):
+        if not self._match(OPEN_PATTERN, "'{'").group(1):
+            while True:
+                key = self._match(KEY_PATTERN, 'a rental id').group(1)
+                key = json.loads(key) if '\\' in key else key[1:-1]
+                yield key, self._value()
+                if self._match(NEXT_PATTERN, "',' or '}'").group(1) == '}':
+                    break
+        self._match(WHITESPACE, 'whitespace')
+        if self.position < len(self.buffer):
+            raise json.JSONDecodeError("Extra data", self.buffer,
+                                       self.position)
+
+
+def iter_rentals(filename):
+    """ this function yields the rentals in a json file one at a time """
+    with open(filename) as file:
+        yield from RentalStream(file)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date(text):
+    """
+    Parse a rental date in '%m/%d/%y' format to a proleptic ordinal.
+
+    Rental dates repeat a lot, so every distinct string is only parsed
+    once. The plain M/D/YY form is handled directly and anything else is
+    handed to strptime so odd input parses (or fails) exactly as before.
+    Subtracting two ordinals gives the same day count as subtracting the
+    datetimes strptime returns.
+    """
+    match = DATE_PATTERN.fullmatch(text)
+    if match:
+        month, day, year = map(int, match.groups())
+        # strptime maps %y 69-99 to 1969-1999 and 00-68 to 2000-2068
+        year += 1900 if year >= 69 else 2000
         try:
-            # The data provided in the input file is radically incorrect
-            # in several way:
-            # 1.) start and end dates are frequently backward in that
-            #     the start date happens after the end date.
-            # 2.) we are not doing any bounds checking on any of the
-            #     following values:
-            #    a.) price_per_day
-            #   `b.) unit_cost
-            #    c.) dates
-            # 3.) we are not catching errors that might come about
-            #     because a string cannot be cast to a date
-            # 4.) we are not ensuring that total_price is >= 0 before
-            #     we try to run sqrt() on it which is an invalid
-            #     mathematical operation
-            # 5.) we are not checking that units_rented is a
-            #     number > 0 which will cause a divide by zero if
-            #     attempted on a value <= 0
-            # 6.) we are not checking that values exist in the dataset
-            #     before attempting to access them. Potental NullValue
-            #     error
-            # 7.) we are calculating additional fields over the entire
-            #     set which makes allowing valid entries through more
-            #     difficult than in these operations were atomic.
-            # 8.) This input file is significantly messed up and should
-            #     be fixed.
-            if check_value_set(value):
-                rental_start = (datetime
-                                .datetime
-                                .strptime(value['rental_start'],
-                                          '%m/%d/%y'))
-                rental_end = (datetime
-                              .datetime
-                              .strptime(value['rental_end'],
-                                        '%m/%d/%y'))
-                value['total_days'] = (rental_end - rental_start).days
-                value['total_price'] = (value['total_days'] *
-                                        value['price_per_day'])
-                value['sqrt_total_price'] = math.sqrt(value['total_price'])
-                value['unit_cost'] = (value['total_price'] /
-                                      value['units_rented'])
-                cleaned_data.update({key: value})
-                LOGGER.debug("Added validated item to scrubbed dataset:\n%s",
-                             value)
-            else:
-                LOGGER.debug("Skipping item due to invalid data issues:\n%s",
-                             value)
-        except ValueError as value_error:
-            LOGGER.error("%s\n%s", value_error, value)
-    #        exit(1)
+            return datetime.date(year, month, day).toordinal()
+        except ValueError:
+            pass
+    return datetime.datetime.strptime(text, '%m/%d/%y').toordinal()
+
+
+class RentalLog:
+    """
+    The log of one run's rental checks.
+
+    Rejections are tallied by reason and reported in one summary() line
+    instead of a line per rental. The per rental debug and trace lines are
+    only built when those levels are on, and debug only describes one
+    rental in every sample.
+    """
+    def __init__(self, sample=1):
+        self.sample = max(1, int(sample))
+        self.debug = LOGGER.isEnabledFor(logging.DEBUG)
+        self.trace = LOGGER.isEnabledFor(TRACE)
+        self.checked = 0
+        self.rejected = 0
+        self.reasons = collections.Counter()
+
+    def record(self, number, value, reasons=()):
+        """ Tally the outcome of checking the number'th rental """
+        self.checked += 1
+        if reasons:
+            self.rejected += 1
+            self.reasons.update(reasons)
+        if self.trace:
+            LOGGER.log(TRACE, "Checked rental %d: %s\n%s", number,
+                       ', '.join(reasons) or 'ok', value)
+        if self.debug:
+            self.describe(number, value, reasons)
+
+    def describe(self, number, value, reasons=()):
+        """ The debug line for the number'th rental, if it is sampled """
+        if number % self.sample:
+            return
+        if reasons:
+            LOGGER.debug("Skipping item due to %s:\n%s",
+                         ', '.join(reasons), value)
+        else:
+            LOGGER.debug("Added validated item to scrubbed dataset:\n%s",
+                         value)
+
+    def merge(self, other):
+        """ Add the tallies of another log, e.g. from a worker """
+        self.checked += other.checked
+        self.rejected += other.rejected
+        self.reasons.update(other.reasons)
+
+    def summary(self):
+        """ Log the rejection reasons of the run """
+        if self.rejected:
+            LOGGER.error("Rejected %d of %d rentals: %s",
+                         self.rejected, self.checked,
+                         ', '.join(f'{reason} ({count})' for reason, count
+                                   in sorted(self.reasons.items(),
+                                             key=lambda t: (-t[1], t[0]))))
+        else:
+            LOGGER.debug("All %d rentals passed the checks", self.checked)
+
+
+def derive_fields(value):
+    """
+    Validate a single rental and add its derived fields in place.
+
+    Returns the reasons the rental was rejected, empty when it was kept.
+    """
+    try:
+        # The data provided in the input file is radically incorrect
+        # in several way:
+        # 1.) start and end dates are frequently backward in that
+        #     the start date happens after the end date.
+        # 2.) we are not doing any bounds checking on any of the
+        #     following values:
+        #    a.) price_per_day
+        #   `b.) unit_cost
+        #    c.) dates
+        # 3.) we are not catching errors that might come about
+        #     because a string cannot be cast to a date
+        # 4.) we are not ensuring that total_price is >= 0 before
+        #     we try to run sqrt() on it which is an invalid
+        #     mathematical operation
+        # 5.) we are not checking that units_rented is a
+        #     number > 0 which will cause a divide by zero if
+        #     attempted on a value <= 0
+        # 6.) we are not checking that values exist in the dataset
+        #     before attempting to access them. Potental NullValue
+        #     error
+        # 7.) we are calculating additional fields over the entire
+        #     set which makes allowing valid entries through more
+        #     difficult than in these operations were atomic.
+        # 8.) This input file is significantly messed up and should
+        #     be fixed.
+        reasons = rejection_reasons(value)
+        if not reasons:
+            rental_start = parse_date(value['rental_start'])
+            rental_end = parse_date(value['rental_end'])
+            value['total_days'] = rental_end - rental_start
+            value['total_price'] = (value['total_days'] *
+                                    value['price_per_day'])
+            value['sqrt_total_price'] = math.sqrt(value['total_price'])
+            value['unit_cost'] = (value['total_price'] /
+                                  value['units_rented'])
+    except ValueError as value_error:
+        reasons = [str(value_error)]
+    return reasons
+
+
+def enrich_rental(value, log, number=0):
+    """
+    derive_fields() for the number'th rental, recording the outcome in
+    log. Returns the rental, or None when it is rejected.
+    """
+    reasons = derive_fields(value)
+    log.record(number, value, reasons)
+    return None if reasons else value
+
+
+class RentalCache:
+    """
+    On disk cache of the results of earlier runs.
+
+    Entries are keyed by rental id and store the rental as it was read,
+    the fields derived from it, or the reasons it was rejected, and the
+    rental as the JSON output lays it out. A rental that still reads the
+    same is copied through without being checked or encoded again,
+    anything new or changed is recomputed. Only the rentals seen in this
+    run are saved back.
+
+    Deriving the fields is only a few sums, encoding the output is what
+    takes the time, so save_to_json_stream() takes the cached layouts
+    from records. The rentals are compared as their marshal bytes, which
+    keep 1, 1.0 and True apart, and the cache is a marshal file of tuples
+    because that loads several times faster than JSON or pickle.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = self.load(filename)
+        self.seen = {}
+        self.records = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def load(filename):
+        """ Read a cache file, an empty cache when missing or unusable """
+        try:
+            # loads() of the whole file, load() reads it a little at a time
+            with open(filename, 'rb') as file:
+                cache = marshal.loads(file.read())
+        except FileNotFoundError:
+            return {}
+        except (OSError, EOFError, ValueError, TypeError) as error:
+            LOGGER.warning("Ignoring unreadable cache %s: %s", filename, error)
+            return {}
+        if (not isinstance(cache, dict)
+                or cache.get('version') != CACHE_VERSION):
+            LOGGER.info("Ignoring cache %s from another version", filename)
+            return {}
+        rentals = cache.get('rentals')
+        if not isinstance(rentals, dict):
+            LOGGER.warning("Ignoring damaged cache %s", filename)
+            return {}
+        return rentals
+
+    def save(self):
+        """ Write the entries of this run, replacing the file atomically """
+        if not self.misses and len(self.seen) == len(self.entries):
+            LOGGER.debug("Cache %s is unchanged", self.filename)
+            return
+        temp_file = self.filename + '.tmp'
+        with open(temp_file, 'wb') as file:
+            marshal.dump({'version': CACHE_VERSION, 'rentals': self.seen},
+                         file)
+        os.replace(temp_file, self.filename)
+
+    def enrich(self, key, value, log, number=0):
+        """ enrich_rental() that reuses the cached result when it can """
+        # version 2 has no back references, so equal rentals give equal bytes
+        inputs = marshal.dumps(value, 2)
+        entry = self.entries.get(key)
+        if self.usable(entry, inputs):
+            self.hits += 1
+            _, fields, reasons, record = entry
+            if fields is not None:
+                value.update(zip(DERIVED_FIELDS, fields))
+        else:
+            self.misses += 1
+            reasons = tuple(derive_fields(value))
+            fields = record = None
+            if not reasons:
+                fields = tuple(value[field] for field in DERIVED_FIELDS)
+                record = format_record(value)
+            entry = (inputs, fields, reasons, record)
+        self.seen[key] = entry
+        if record is not None:
+            self.records[key] = record
+        log.record(number, value, reasons)
+        return None if reasons else value
+
+    @staticmethod
+    def usable(entry, inputs):
+        """
+        True when entry is a well formed cache entry for a rental that
+        reads as inputs. Damaged entries count as misses.
+        """
+        if not (isinstance(entry, tuple) and len(entry) == 4
+                and entry[0] == inputs):
+            return False
+        _, fields, reasons, record = entry
+        if not (isinstance(reasons, tuple)
+                and all(isinstance(reason, str) for reason in reasons)):
+            return False
+        if reasons:
+            return fields is None and record is None
+        return (isinstance(fields, tuple)
+                and len(fields) == len(DERIVED_FIELDS)
+                and isinstance(record, str))
+
+    def hit_ratio(self):
+        """ The share of rentals copied from the cache """
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def enrich_cached(key, value, log, number, cache=None):
+    """ enrich_rental() through the cache, when there is one """
+    if cache is None:
+        return enrich_rental(value, log, number)
+    return cache.enrich(key, value, log, number)
+
+
+def calculate_additional_fields(data, workers=1, sample=1, cache=None):
+    """
+    this function creates secondary data points from the primary ones
+
+    With a RentalCache only new or changed rentals are recomputed.
+    """
+    if workers > 1:
+        return dict(iter_additional_fields(data.items(), workers,
+                                           sample=sample))
+
+    log = RentalLog(sample)
+    cleaned_data = {}
+    for number, (key, value) in enumerate(data.items()):
+        if enrich_cached(key, value, log, number, cache) is not None:
+            cleaned_data.update({key: value})
+    log.summary()
 
     return cleaned_data
 
 
-def check_value_set(value):
+def iter_additional_fields(items, workers=1, chunk_size=CHUNK_SIZE,
+                           sample=1):
     """
-    function to attempt to validate the inputs are within
-    expected values / ranges. If problems with an entry are
-    found, it will not make it into the output file. It will
-    be noted in the debug log so that the source file may
-    be repaired by the file originator.
+    Streaming calculate_additional_fields(). Takes and yields
+    (rental_id, rental) pairs, dropping the rejected rentals.
+
+    With workers > 1 the rentals are enriched chunk_size at a time by a
+    process pool. Results still come back in input order.
     """
-    validated = True
+    log = RentalLog(sample)
+    if workers > 1:
+        yield from _iter_parallel(items, workers, chunk_size, log)
+    else:
+        for number, (key, value) in enumerate(items):
+            if enrich_rental(value, log, number) is not None:
+                yield key, value
+    log.summary()
+
+
+class RecordingHandler(logging.Handler):
+    """ Keeps log records so a worker can send them back to the parent """
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        # Format the message now, the arguments may not pickle
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        self.records.append(record)
+
+
+def enrich_chunk(job):
+    """
+    Enrich a (items, log_level, sample, offset) chunk of rentals in a
+    worker process. offset is the number of the chunk's first rental.
+
+    Returns the valid (rental_id, rental) pairs, the log records written
+    while checking them and the chunk's RentalLog.
+    """
+    items, log_level, sample, offset = job
+    handler = RecordingHandler()
+    handlers = LOGGER.handlers
+    LOGGER.handlers = [handler]
+    LOGGER.setLevel(log_level)
     try:
-        LOGGER.debug("Checking for missing values")
-        assert value['price_per_day'], 'missing price_per_day'
-        assert value['product_code'], 'missing product code'
-        assert value['rental_start'], 'missing rental_start value'
-        assert value['rental_end'], 'missing rental_end value'
-        assert value['units_rented'] is not None, 'missing units_rented value'
-    except AssertionError as assert_error:
-        LOGGER.warning("Data missing check failed: %s\n%s",
-                       assert_error,
-                       value)
-        validated = False
+        log = RentalLog(sample)
+        cleaned = [(key, value)
+                   for number, (key, value) in enumerate(items, offset)
+                   if enrich_rental(value, log, number) is not None]
+        return cleaned, handler.records, log
+    finally:
+        LOGGER.handlers = handlers
+
 
+def _iter_parallel(items, workers, chunk_size, log):
+    """ Enrich chunks of rentals in a process pool, keeping their order """
+    items = iter(items)
+    log_level = LOGGER.getEffectiveLevel()
+    chunks = iter(lambda: list(itertools.islice(items, chunk_size)), [])
+    with mp.Pool(workers) as pool:
+        # Only keep a few chunks in flight so streaming input isn't read
+        # into memory faster than the results are written out.
+        pending = collections.deque()
+        offset = 0
+        for chunk in itertools.chain(chunks, [None]):
+            if chunk is not None:
+                job = (chunk, log_level, log.sample, offset)
+                pending.append(pool.apply_async(enrich_chunk, (job,)))
+                offset += len(chunk)
+            while pending and (chunk is None or len(pending) > 2 * workers):
+                cleaned, records, chunk_log = pending.popleft().get()
+                # Replay the worker's log here, one chunk at a time
+                for record in records:
+                    LOGGER.handle(record)
+                log.merge(chunk_log)
+                yield from cleaned
+
+
+def ordinal_or_zero(text):
+    """ parse_date() for the columns, 0 when the date can't be parsed """
     try:
-        LOGGER.debug("Checking values make sense")
-        assert value['price_per_day'] >= 0, 'invalid price_per_day'
-        start = datetime.datetime.strptime(value['rental_start'], '%m/%d/%y')
-        end = datetime.datetime.strptime(value['rental_end'], '%m/%d/%y')
-        assert start <= end, 'invalid rental dates'
-        assert value['units_rented'] >= 0, 'invalid units_rented value'
-    except AssertionError as assert_error:
-        LOGGER.error("Data acceptability check failed: %s\n%s",
-                     assert_error,
-                     value)
-        validated = False
+        return parse_date(text)
+    except ValueError:
+        return 0
+
+
+def tally_rejections(log, columns, derived):
+    """ Add the rejections the columns found to log in one go """
+    checked = ~columns['fallback']
+    missing = derived['missing'][checked]
+    invalid = derived['invalid'][checked]
+    log.checked += int(checked.sum())
+    log.rejected += int(np.count_nonzero(missing | invalid))
+    for checks, codes in [(MISSING_CHECKS, missing),
+                          (INVALID_CHECKS, invalid)]:
+        for code, count in enumerate(np.bincount(codes).tolist()):
+            if code and count:
+                log.reasons[checks[code]] += count
+
+
+def check_one_at_a_time(data, columns, derived, log):
+    """
+    Check the rentals that didn't fit the columns and describe the sampled
+    ones, all in input order. Returns the keys of the odd rentals kept.
+    """
+    keys = list(data)
+    kept = set()
+    rows = columns['fallback'].copy()
+    if log.debug:
+        rows[::log.sample] = True
+    for row in np.flatnonzero(rows).tolist():
+        key = keys[row]
+        value = data[key]
+        if columns['fallback'][row]:
+            if enrich_rental(value, log, row) is not None:
+                kept.add(key)
+        else:
+            log.describe(row, value,
+                         [checks[code] for checks, code in
+                          [(MISSING_CHECKS, derived['missing'][row]),
+                           (INVALID_CHECKS, derived['invalid'][row])]
+                          if code])
+    return kept
 
-    return validated
+
+def calculate_additional_fields_numpy(data, sample=1):
+    """
+    Columnar calculate_additional_fields(), same results and rejections.
+
+    The derived fields are computed for all rentals at once and only
+    written back into the rental dicts of the valid ones at the end.
+    """
+    if np is None:
+        raise ImportError("numpy is needed for the columnar mode")
+    log = RentalLog(sample)
+    if not data:
+        log.summary()
+        return {}
+    columns = rental_columns.rental_columns(data, ordinal_or_zero)
+    derived = rental_columns.derived_columns(columns)
+    tally_rejections(log, columns, derived)
+
+    valid = ~columns['fallback'] & (derived['missing'] == 0) & (
+        derived['invalid'] == 0)
+    results = zip(itertools.compress(data.items(), valid.tolist()),
+                  *(derived[field][valid].tolist()
+                    for field in ['total_days', 'total_price',
+                                  'sqrt_total_price', 'unit_cost']))
+    cleaned_data = {}
+    for (key, value), days, total, root, cost in results:
+        value['total_days'] = days
+        value['total_price'] = total
+        value['sqrt_total_price'] = root
+        value['unit_cost'] = cost
+        cleaned_data[key] = value
+
+    kept = check_one_at_a_time(data, columns, derived, log)
+    if kept:
+        # Put the odd rentals that passed back in their input order
+        kept.update(cleaned_data)
+        cleaned_data = {key: value for key, value in data.items()
+                        if key in kept}
+    log.summary()
+    return cleaned_data
+
+
+def rejection_reasons(value):
+    """
+    function to attempt to validate the inputs are within
+    expected values / ranges. Returns the first missing value
+    and the first unacceptable value found, if any. A rental
+    with problems will not make it into the output file. The
+    reasons are tallied in the log summary so that the source
+    file may be repaired by the file originator.
+    """
+    reasons = []
+    if not value['price_per_day']:
+        reasons.append(MISSING_CHECKS[1])
+    elif not value['product_code']:
+        reasons.append(MISSING_CHECKS[2])
+    elif not value['rental_start']:
+        reasons.append(MISSING_CHECKS[3])
+    elif not value['rental_end']:
+        reasons.append(MISSING_CHECKS[4])
+    elif value['units_rented'] is None:
+        reasons.append(MISSING_CHECKS[5])
+
+    try:
+        if not value['price_per_day'] >= 0:
+            reasons.append(INVALID_CHECKS[1])
+        elif (parse_date(value['rental_start']) >
+              parse_date(value['rental_end'])):
+            reasons.append(INVALID_CHECKS[2])
+        elif not value['units_rented'] > 0:
+            reasons.append(INVALID_CHECKS[3])
+    except ValueError:
+        reasons.append(INVALID_CHECKS[4])
+    return reasons
 
 
 def save_to_json(filename, data):
@@ -201,9 +716,69 @@ def save_to_json(filename, data):
         LOGGER.warning("Data is invalid. Skipping file writing")
 
 
+def format_record(value):
+    """ A rental as json.dump(data, indent=2) lays it out inside data """
+    if value and isinstance(value, dict) and not any(
+            isinstance(item, (dict, list, tuple)) for item in value.values()):
+        return '{\n    ' + RECORD_ENCODER.encode(value)[1:-1] + '\n  }'
+    return json.dumps(value, indent=2).replace('\n', '\n  ')
+
+
+def save_to_json_stream(filename, items, records=None):
+    """
+    this function saves (rental_id, rental) pairs to a json file as they
+    arrive, formatted exactly like save_to_json(). records holds rentals
+    already laid out by format_record(), keyed by rental id.
+    """
+    records = records or {}
+    items = iter(items)
+    first = next(items, None)
+    if first is None:
+        LOGGER.warning("Data is invalid. Skipping file writing")
+        return
+
+    LOGGER.debug("Saving file %s", filename)
+    # Write next to the output and move it into place at the end, so a
+    # bad record part way through the input doesn't leave half a file.
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'w') as file:
+        separator = '{\n  '
+        for key, value in itertools.chain([first], items):
+            record = records.get(key)
+            if record is None:
+                record = format_record(value)
+            file.write(f'{separator}{json.dumps(key)}: {record}')
+            separator = ',\n  '
+        file.write('\n}')
+    os.replace(temp_file, filename)
+
+
 if __name__ == "__main__":
     ARGS = parse_cmd_arguments()
     setup_logging(ARGS.debug)
-    DATA = load_rentals_file(ARGS.input)
-    DATA = calculate_additional_fields(DATA)
-    save_to_json(ARGS.output, DATA)
+    CACHE = RentalCache(ARGS.cache) if ARGS.cache else None
+    if ARGS.stream:
+        RENTALS = iter_additional_fields(iter_rentals(ARGS.input),
+                                         ARGS.workers,
+                                         sample=ARGS.sample)
+    else:
+        DATA = load_rentals_file(ARGS.input)
+        if ARGS.columnar:
+            DATA = calculate_additional_fields_numpy(DATA, ARGS.sample)
+        else:
+            DATA = calculate_additional_fields(DATA, ARGS.workers,
+                                               ARGS.sample, CACHE)
+        RENTALS = DATA.items()
+
+    if ARGS.output.endswith('.npz'):
+        rental_columns.save_to_npz(ARGS.output, RENTALS)
+    elif ARGS.stream:
+        save_to_json_stream(ARGS.output, RENTALS)
+    elif CACHE:
+        save_to_json_stream(ARGS.output, RENTALS, CACHE.records)
+    else:
+        save_to_json(ARGS.output, DATA)
+    if CACHE:
+        CACHE.save()
+        print(f"Cache hit ratio {CACHE.hit_ratio():.1%} "
+              f"({CACHE.hits} of {CACHE.hits + CACHE.misses} rentals)")
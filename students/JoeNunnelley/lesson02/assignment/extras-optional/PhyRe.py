@@ -0,0 +1,217 @@
+#! /usr/bin/env python3
+
+"""
+CODENAME:     PhyRe
+DESCRIPTION:
+Copyright (c) 2009 Ronald R. Ferrucci, Federico Plazzi, and Marco Passamonti..
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+Python 3 port of lessons/lesson02/assignment/extras-optional/PhyRe.py
+
+usage: PhyRe.py samplefile popfile d1 d2 [-o out] [-p permutations]
+                [-c y|n] [-b y|n] [-l y|n] [-m y|n] [-w workers]
+                [-k cache.npz] [-s seed] [-a tolerance]
+
+The command line program only. The calculations live in phyre_api, which
+is imported after the arguments are parsed so --help and usage errors do
+not wait for numpy. The report goes to <out>.out and the funnel to
+<out up to the first _>_funnel.out.
+
+With -a each funnel dimension stops as soon as the standard error of its
+5% and 95% limits is within the tolerance, -p being the most permutations
+it may use, and the permutations used are written on every funnel line.
+"""
+# The program keeps its original name and % formatted report lines
+# pylint: disable=invalid-name,consider-using-f-string
+import argparse
+import os
+
+
+def funnel_name(out):
+    """ The funnel output file, named after the part of out before any _ """
+    directory, name = os.path.split(out)
+    return os.path.join(directory, name.split('_')[0] + '_funnel.out')
+
+
+def print_results(pop, results, file):
+    """ this function writes the results of every sample to file """
+    print("Number of taxa and path lengths for each taxonomic level:",
+          file=file)
+    for level in pop.levels:
+        print('%-10s\t%d\t%.4f' % (level, pop.taxa[level],
+                                   pop.lengths[level]), file=file)
+    print(file=file)
+
+    for name, result in results.items():
+        print("---------------------------------------------------", file=file)
+        print("Results for sample: ", name, '\n', file=file)
+        print("Dimension for this sample is", result['n'], '\n', file=file)
+        print("Number of taxa and pairwise comparisons  at each taxon level:",
+              file=file)
+
+        above = 0
+        for level in pop.levels:
+            print('%-10s\t%i\t%i' % (level, len(result['taxon'][level]),
+                                     result['N'][level] - above), file=file)
+            above = result['N'][level]
+
+        print("\nNumber of pairwise comparisons is for pairs that differ "
+              "at each level excluding comparisons that differ at upper "
+              "levels\n", file=file)
+        for label, value in [('Average taxonomic distinctness     ',
+                              result['atd']),
+                             ('Variation in taxonomic distinctness',
+                              result['vtd']),
+                             ('Minimum taxonomic distinctness     ',
+                              result['euler']['TDmin']),
+                             ('Maximum taxonomic distinctness     ',
+                              result['euler']['TDmax']),
+                             ("von Euler's index of imbalance     ",
+                              result['euler']['EI'])]:
+            print('%s = %.4f' % (label, value), file=file)
+        print(file=file)
+
+
+def print_funnel(limits, p, seed, file, tolerance=None):
+    """
+    this function writes the funnel confidence limits to file, with the
+    permutations used by each dimension when they stop at tolerance
+    """
+    print("Confidence limits for average taxonomic distinctness and "
+          "variation in taxonomic distinctness\nlimits are lower 95% "
+          "limit for AvTD and upper 95% limit for VarTD\n", file=file)
+    print("Number of permutations for confidence limits =", p, file=file)
+    if tolerance is not None:
+        print("Permutations stop once the standard error of the 5% and 95% "
+              "limits is within", tolerance, file=file)
+    print("Random seed for the permutations =", seed, '\n', file=file)
+    print("dimension AvTD05%   AvTDmean  AvTD95%   AvTDup    VarTDlow   "
+          "VarTD05%   VarTDmean  VarTD95%" +
+          ("   permutations" if tolerance is not None else ""), file=file)
+    for line in limits:
+        # adaptive funnels put the permutations used after the dimension
+        d, avtd, vartd = line[0], line[-2], line[-1]
+        text = ('%i        %6.4f   %6.4f   %6.4f   %6.4f   %6.4f   %6.4f   '
+                '%6.4f   %6.4f' % ((d,) + tuple(avtd) + tuple(vartd)))
+        if tolerance is not None:
+            text += '   %i' % line[1]
+        print(text, file=file, flush=True)
+
+
+def parse_cmd_arguments():
+    """ this function parses the command line arguments """
+    parser = argparse.ArgumentParser(
+        description='Average taxonomic distinctness of samples.')
+    parser.add_argument('samplefile',
+                        help='sample file, or list of sample files with -b y')
+    parser.add_argument('popfile', help='population master list')
+    parser.add_argument('d1', help='smallest funnel dimension', type=int)
+    parser.add_argument('d2', help='largest funnel dimension', type=int)
+    parser.add_argument('-o',
+                        '--out',
+                        help='output file name without .out')
+    parser.add_argument('-p',
+                        '--permutations',
+                        help='permutations for the confidence limits',
+                        type=int,
+                        default=1000)
+    parser.add_argument('-c',
+                        '--ci',
+                        help='write the funnel confidence limits (y/n)',
+                        default='y')
+    parser.add_argument('-b',
+                        '--batch',
+                        help='samplefile lists sample files (y/n)',
+                        default='n')
+    parser.add_argument('-l',
+                        '--pathlengths',
+                        help='use the Coefficients: line of popfile (y/n)',
+                        default='n')
+    parser.add_argument('-m',
+                        '--missing',
+                        help="'/' repeats the taxon above (y/n)",
+                        default='n')
+    parser.add_argument('-w',
+                        '--workers',
+                        help='processes for the samples and the funnel',
+                        type=int,
+                        default=1)
+    parser.add_argument('-k',
+                        '--cache',
+                        help='keep the coded population in this .npz file')
+    parser.add_argument('-s',
+                        '--seed',
+                        help='random seed for reproducible funnel limits',
+                        type=int)
+    parser.add_argument('-a',
+                        '--adaptive',
+                        help='stop each funnel dimension once the standard '
+                             'error of its limits is within this tolerance',
+                        type=float)
+    return parser.parse_args()
+
+
+def main():
+    """ The main entry point function """
+    args = parse_cmd_arguments()
+    # pylint: disable-next=import-outside-toplevel
+    import phyre_api
+
+    out = args.out or args.samplefile.split('.')[0]
+    if args.batch == 'y':
+        with open(args.samplefile) as file:
+            files = [line.strip() for line in file if line.strip()]
+    else:
+        files = [args.samplefile]
+
+    pop = phyre_api.load_population(args.popfile, args.missing,
+                                    args.pathlengths, args.cache)
+    with open(out + '.out', 'w') as output:
+        if pop.duplicates:
+            print("Population master list contains duplicates:", file=output)
+            for species in pop.duplicates:
+                print(species, '\n', file=output)
+        print("Output from Average Taxonomic Distinctness\n", file=output)
+        for filename in files:
+            print(filename, file=output)
+        print_results(pop, phyre_api.analyze(pop, files, args.workers),
+                      output)
+        print("---------------------------------------------------",
+              file=output)
+
+    if args.ci == 'y':
+        seed = args.seed
+        if seed is None:
+            seed = phyre_api.new_seed()
+        if args.adaptive is None:
+            limits = phyre_api.funnel(pop, args.permutations, args.d1,
+                                      args.d2, args.workers, seed)
+        else:
+            limits = phyre_api.adaptive_funnel(pop, args.permutations,
+                                               args.d1, args.d2,
+                                               args.adaptive, args.workers,
+                                               seed)
+        with open(funnel_name(out), 'w') as output:
+            print_funnel(limits, args.permutations, seed, output,
+                         args.adaptive)
+
+
+if __name__ == "__main__":
+    main()
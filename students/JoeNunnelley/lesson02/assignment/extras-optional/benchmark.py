@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+"""
+Benchmark and regression check of the PhyRe kernels
+
+Master lists of each requested size (species x depth x breadth) are
+generated once with generate_taxonomy and a fixed seed. Every kernel of
+phyre_api is timed against them several times and the median and fastest
+wall clock times are reported as a table and, optionally, as JSON so runs
+can be compared over time.
+
+The numbers themselves are checked too. For each size the path lengths,
+AvTD, VarTD and von Euler's index of a few fixed samples and a short
+seeded funnel are compared against the frozen values in reference.json.
+Run with -z to freeze the current values after a deliberate change.
+"""
+import argparse
+import json
+import math
+import os
+import statistics
+import sys
+import time
+import numpy as np
+import generate_taxonomy
+import phyre_api
+
+
+SIZES = ['1000x4x4', '10000x5x5', '100000x6x6']
+SEED = 23
+SAMPLE_SIZE = 200
+FUNNEL = (1000, 10, 20)
+REFERENCE_SAMPLES = [5, 20, 100]
+REFERENCE_FUNNEL = (200, 5, 7)
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'reference.json')
+
+
+def size(text):
+    """ (species, depth, breadth) of a size such as 1000x4x4 """
+    try:
+        species, depth, breadth = map(int, text.split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"{text!r} is not species x depth x breadth, "
+            f"e.g. 1000x4x4") from None
+    return species, depth, breadth
+
+
+def population_file(directory, name):
+    """ Return the master list of size name, generating it when missing """
+    filename = os.path.join(directory, f'taxonomy_{name}.txt')
+    if not os.path.exists(filename):
+        os.makedirs(directory, exist_ok=True)
+        print(f"Generating {filename}")
+        generate_taxonomy.write_population(filename, *size(name), seed=SEED)
+    return filename
+
+
+def sample_of(pop, count, seed=SEED):
+    """ Sorted rows of a fixed random sample of count species """
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(len(pop.species), min(count, len(pop.species)),
+                              replace=False))
+
+
+def kernels(popfile, pop):
+    """ The timed kernels of phyre_api as {name: function()} """
+    rows = sample_of(pop, SAMPLE_SIZE)
+    p, d1, d2 = FUNNEL
+    return {'parse': lambda: phyre_api.Population.read(popfile),
+            'path_lengths': lambda: phyre_api.path_lengths(pop.levels,
+                                                           pop.names),
+            'avtd': lambda: phyre_api.avtd(pop, rows),
+            'vartd': lambda: phyre_api.vartd(pop, rows),
+            'euler_index': lambda: phyre_api.euler_index(pop, rows),
+            'funnel': lambda: list(phyre_api.funnel(pop, p, d1, d2,
+                                                    seed=SEED))}
+
+
+def time_kernel(function, repeat):
+    """ Wall clock time of each of repeat calls of function """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def print_table(results, header=True):
+    """ Print the result records as a table """
+    if header:
+        print(f"{'kernel':<14} {'size':>12} {'median s':>10} {'min s':>10}")
+    for result in results:
+        print(f"{result['kernel']:<14} {result['size']:>12} "
+              f"{result['median']:>10.5f} {result['min']:>10.5f}")
+
+
+def run(files, repeat=5):
+    """ Time the kernels against each {size: master list}, return results """
+    results = []
+    for name, popfile in files.items():
+        pop = phyre_api.Population.read(popfile)
+        for kernel, function in kernels(popfile, pop).items():
+            timings = time_kernel(function, repeat)
+            results.append({'kernel': kernel,
+                            'size': name,
+                            'runs': len(timings),
+                            'median': statistics.median(timings),
+                            'min': min(timings)})
+            print_table(results[-1:], header=len(results) == 1)
+    return results
+
+
+def regressions(results, previous, tolerance=0.1):
+    """
+    Compare results against an earlier run.
+
+    Returns (kernel, size, old median, new median) for every kernel and
+    size whose median got slower by more than tolerance. This is the
+    regressions() of lesson06's benchmark.py keyed by kernel and size, a
+    copy so each lesson still runs on its own.
+    """
+    old = {(result['kernel'], result['size']): result['median']
+           for result in previous}
+    slower = []
+    for result in results:
+        key = (result['kernel'], result['size'])
+        if key in old and result['median'] > old[key] * (1 + tolerance):
+            slower.append(key + (old[key], result['median']))
+    return slower
+
+
+def reference(pop):
+    """ The values of pop checked against the frozen reference """
+    coef, lengths, taxa = phyre_api.path_lengths(pop.levels, pop.names)
+    samples = []
+    for count in REFERENCE_SAMPLES:
+        rows = sample_of(pop, count)
+        samples.append({'n': len(rows),
+                        'atd': phyre_api.avtd(pop, rows),
+                        'vtd': phyre_api.vartd(pop, rows),
+                        'euler': phyre_api.euler_index(pop, rows)})
+    p, d1, d2 = REFERENCE_FUNNEL
+    limits = [[d] + list(avtd) + list(vartd) for d, avtd, vartd
+              in phyre_api.funnel(pop, p, d1, d2, seed=SEED)]
+    # through JSON so the values compare like the ones read back from disk
+    return json.loads(json.dumps({'coef': coef,
+                                  'lengths': lengths,
+                                  'taxa': taxa,
+                                  'samples': samples,
+                                  'funnel': limits}))
+
+
+def compare(values, frozen, tolerance=1e-9, path=''):
+    """ The paths of every value differing from the frozen reference """
+    if isinstance(frozen, dict) and isinstance(values, dict):
+        differ = [f'{path}/{key}' for key in set(frozen) ^ set(values)]
+        for key in set(frozen) & set(values):
+            differ += compare(values[key], frozen[key], tolerance,
+                              f'{path}/{key}')
+        return sorted(differ)
+    if isinstance(frozen, list) and isinstance(values, list):
+        if len(frozen) != len(values):
+            return [path]
+        differ = []
+        for index, (value, expected) in enumerate(zip(values, frozen)):
+            differ += compare(value, expected, tolerance, f'{path}/{index}')
+        return differ
+    if isinstance(frozen, float) and isinstance(values, (int, float)):
+        same = (math.isnan(frozen) and math.isnan(values)
+                or math.isclose(values, frozen, rel_tol=tolerance,
+                                abs_tol=tolerance))
+    else:
+        same = values == frozen
+    return [] if same else [path]
+
+
+def verify(files, filename=REFERENCE):
+    """
+    Check each {size: master list} against the frozen reference file.
+
+    Returns a list of 'size: path' for every value that differs. Sizes
+    missing from the reference are reported and skipped.
+    """
+    with open(filename) as file:
+        frozen = json.load(file)
+    differ = []
+    for name, popfile in files.items():
+        if name not in frozen:
+            print(f"No reference for {name}")
+            continue
+        values = reference(phyre_api.Population.read(popfile))
+        differ += [f'{name}: {path}' for path in compare(values,
+                                                         frozen[name])]
+    return differ
+
+
+def freeze(files, filename=REFERENCE):
+    """ Write the values of each {size: master list} to the reference file """
+    frozen = {}
+    if os.path.exists(filename):
+        with open(filename) as file:
+            frozen = json.load(file)
+    for name, popfile in files.items():
+        frozen[name] = reference(phyre_api.Population.read(popfile))
+    with open(filename, 'w') as file:
+        json.dump(frozen, file, indent=1, sort_keys=True)
+        file.write('\n')
+
+
+def parse_cmd_arguments():
+    """ this function parses the command line arguments """
+    parser = argparse.ArgumentParser(
+        description='Benchmark and check the PhyRe kernels.')
+    parser.add_argument('-s',
+                        '--sizes',
+                        help='master list sizes as species x depth x breadth',
+                        type=size,
+                        nargs='+',
+                        default=[size(name) for name in SIZES])
+    parser.add_argument('-d',
+                        '--data-dir',
+                        help='directory for the generated master lists',
+                        default='data/benchmark')
+    parser.add_argument('-r',
+                        '--repeat',
+                        help='number of runs per kernel',
+                        type=int,
+                        default=5)
+    parser.add_argument('-f',
+                        '--reference',
+                        help='frozen reference values to check against',
+                        default=REFERENCE)
+    parser.add_argument('-z',
+                        '--freeze',
+                        help='write the current values to the reference '
+                             'instead of checking them',
+                        action='store_true')
+    parser.add_argument('-n',
+                        '--no-timing',
+                        help='only check the values, do not time kernels',
+                        action='store_true')
+    parser.add_argument('-j',
+                        '--json',
+                        help='also write the timings to this JSON file')
+    parser.add_argument('-c',
+                        '--compare',
+                        help='JSON timings of an earlier run to check for '
+                             'regressions against')
+    parser.add_argument('-t',
+                        '--tolerance',
+                        help='allowed slow down before a median counts as a '
+                             'regression (default 0.1 = 10%%)',
+                        type=float,
+                        default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    """ The main entry point function """
+    args = parse_cmd_arguments()
+    names = ['x'.join(map(str, sizes)) for sizes in args.sizes]
+    files = {name: population_file(args.data_dir, name) for name in names}
+
+    if args.freeze:
+        freeze(files, args.reference)
+        return
+    failed = False
+    for difference in verify(files, args.reference):
+        print(f"MISMATCH {difference}")
+        failed = True
+
+    if not args.no_timing:
+        results = run(files, args.repeat)
+        if args.json:
+            with open(args.json, 'w') as json_file:
+                json.dump(results, json_file, indent=2)
+        if args.compare:
+            with open(args.compare) as json_file:
+                slower = regressions(results, json.load(json_file),
+                                     args.tolerance)
+            for kernel, name, old, new in slower:
+                print(f"REGRESSION {kernel} at {name}: median {old:.5f}s "
+                      f"-> {new:.5f}s")
+                failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
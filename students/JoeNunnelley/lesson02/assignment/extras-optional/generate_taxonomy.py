@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+"""
+Generate synthetic PhyRe master lists
+
+A taxonomy of depth levels is grown from breadth taxa at the top level,
+every taxon getting between 1 and 2 * breadth - 1 taxa below it, so each
+level has breadth times as many taxa as the one above on average. Every
+species is then put in a random taxon of the lowest level. The same
+arguments and seed always give the same file.
+"""
+import argparse
+import random
+
+
+LEVEL_NAMES = ['Phylum', 'Class', 'Order', 'Family', 'Genus', 'Subgenus']
+
+
+def level_names(depth):
+    """ The names of depth taxonomic levels, from the top down """
+    return (LEVEL_NAMES + [f'Level{number}' for number in
+                           range(len(LEVEL_NAMES) + 1, depth + 1)])[:depth]
+
+
+def build_tree(rng, depth, breadth):
+    """
+    The parent of every taxon at each level of a random taxonomy.
+
+    Returns one list per level holding, for each of its taxa, the index
+    of its parent taxon in the level above (None at the top level).
+    """
+    parents = [[None] * breadth]
+    for _ in range(depth - 1):
+        level = []
+        for parent in range(len(parents[-1])):
+            level.extend([parent] * rng.randint(1, 2 * breadth - 1))
+        parents.append(level)
+    return parents
+
+
+def write_population(filename, species, depth=5, breadth=4, seed=1):
+    """ Write a random master list of species species and return its name """
+    rng = random.Random(seed)
+    names = level_names(depth)
+    parents = build_tree(rng, depth, breadth)
+    paths = {}
+
+    def path(leaf):
+        """ The taxa of a lowest level taxon from the top down, as text """
+        if leaf not in paths:
+            taxa = []
+            taxon = leaf
+            for level in reversed(range(depth)):
+                taxa.append(f'{names[level]}{taxon}')
+                taxon = parents[level][taxon]
+            paths[leaf] = ' '.join(reversed(taxa))
+        return paths[leaf]
+
+    leaves = len(parents[-1])
+    with open(filename, 'w') as file:
+        file.write('Taxon: ' + ' '.join(names) + '\n')
+        for number in range(species):
+            file.write(f'sp{number} {path(rng.randrange(leaves))}\n')
+    return filename
+
+
+def parse_cmd_arguments():
+    """ this function parses the command line arguments """
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic PhyRe master list.')
+    parser.add_argument('-o',
+                        '--output',
+                        help='master list file name',
+                        default='population.txt')
+    parser.add_argument('-n',
+                        '--species',
+                        help='number of species',
+                        type=int,
+                        default=10_000)
+    parser.add_argument('-d',
+                        '--depth',
+                        help='number of taxonomic levels',
+                        type=int,
+                        default=5)
+    parser.add_argument('-b',
+                        '--breadth',
+                        help='average taxa below each taxon',
+                        type=int,
+                        default=4)
+    parser.add_argument('-s',
+                        '--seed',
+                        help='random seed',
+                        type=int,
+                        default=1)
+    return parser.parse_args()
+
+
+def main():
+    """ The main entry point function """
+    args = parse_cmd_arguments()
+    write_population(args.output, args.species, args.depth, args.breadth,
+                     args.seed)
+
+
+if __name__ == "__main__":
+    main()
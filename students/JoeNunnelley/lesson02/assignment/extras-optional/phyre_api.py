@@ -0,0 +1,753 @@
+#! /usr/bin/env python3
+
+"""
+CODENAME:     PhyRe
+DESCRIPTION:
+Copyright (c) 2009 Ronald R. Ferrucci, Federico Plazzi, and Marco Passamonti..
+Permission is hereby granted, free of charge, to any person
+obtaining a copy of this software and associated documentation
+files (the "Software"), to deal in the Software without
+restriction, including without limitation the rights to use,
+copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the
+Software is furnished to do so, subject to the following
+conditions:
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES
+OF MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT
+HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR
+OTHER DEALINGS IN THE SOFTWARE.
+
+The PhyRe calculations as a library. Importing it runs nothing and
+nothing here prints, every function works on the Population it is given:
+
+    pop = phyre_api.load_population('population.txt')
+    sample = phyre_api.load_sample(pop, 'sample.txt')
+    phyre_api.avtd(pop, sample), phyre_api.vartd(pop, sample)
+    phyre_api.euler_index(pop, sample)
+    for d, avtd_limits, vartd_limits in phyre_api.funnel(pop, 1000, 10, 70):
+        ...
+
+PhyRe.py is the command line program on top of it.
+
+The population is coded once as a species x level matrix of integer taxon
+codes. The taxa of a sample are counted with bincount and the number of
+pairs of species in different taxa at each level comes from the closed
+form N**2 - sum(count**2) instead of comparing every pair of taxa.
+
+The funnel permutations run in blocks, optionally on a process pool.
+Every block draws from its own random stream spawned from the seed, so a
+seed gives the same confidence limits with any number of workers. A block
+is drawn as one samples x d matrix of population rows and the pair counts
+of all its samples are computed together. adaptive_funnel() stops each
+dimension as soon as the standard error of its limits is small enough.
+
+A Population can be kept in a .npz file so later runs against an
+unchanged master list skip parsing it.
+"""
+import array
+import contextlib
+import itertools
+import json
+import operator
+import multiprocessing as mp
+import os
+import numpy as np
+
+
+# permutations drawn with one random stream and evaluated as one matrix
+FUNNEL_BLOCK = 1000
+
+# first permutations drawn before adaptive_funnel() checks convergence
+ADAPTIVE_BLOCK = 250
+
+# format of the files written by Population.save()
+POPULATION_VERSION = 2
+
+# the population of a pool worker process, set by the pool initializer
+_POOL_POPULATION = None
+
+
+def read_headers(file):
+    """
+    Read the Taxon: and Coefficients: lines at the top of a master list.
+
+    Returns (levels, positions, coefficients, first species line). The
+    positions are the field of each level on a species line, coefficients
+    None without a Coefficients: line.
+    """
+    levels = []
+    positions = []
+    coefficients = None
+    for line in file:
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'Taxon:':
+            levels = fields[1:]
+            positions = [fields.index(level) for level in levels]
+        elif fields[0] == 'Coefficients:':
+            coefficients = [float(value) for value in fields[1:]]
+        else:
+            return levels, positions, coefficients, line
+    return levels, positions, coefficients, ''
+
+
+def first_appearance(column, names):
+    """
+    Renumber a column of taxon codes by first appearance, dropping codes
+    no species uses any more. Returns (column, names).
+    """
+    used, first, inverse = np.unique(column, return_index=True,
+                                     return_inverse=True)
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return rank[inverse].astype(np.int32), [names[used[i]] for i in order]
+
+
+def taxa_getter(positions):
+    """ A function picking the taxa of a species line out as a tuple """
+    getter = operator.itemgetter(*positions)
+    if len(positions) > 1:
+        return getter
+    return lambda fields: (getter(fields),)
+
+
+def fill_missing(values):
+    """ A species' taxa with each '/' replaced by the taxon above it """
+    filled = []
+    above = ''
+    for value in values:
+        if value != '/':
+            above = value
+        filled.append(above)
+    return filled
+
+
+def parse_population(popfile, missing='n'):  # pylint: disable=too-many-locals
+    """
+    Stream a population master list into integer taxon codes.
+
+    The Taxon: line names the taxonomic levels from the top down and an
+    optional Coefficients: line gives their path lengths, both before the
+    first species. Every other line is a species followed by its taxon at
+    each level. With missing 'y' a '/' repeats the taxon of the level
+    above. Taxon names are interned into a code per level as the lines
+    are read, so only one row of codes is kept per species.
+
+    Returns (levels, species, codes, names, coefficients, duplicates). A
+    species listed more than once keeps its first place and its last
+    listing, and is reported in duplicates each time it is repeated.
+    """
+    with open(popfile) as file:
+        levels, positions, coefficients, line = read_headers(file)
+        if not levels:
+            raise ValueError(f"{popfile} has no Taxon: line")
+        width = len(levels)
+        taxa_of = taxa_getter(positions)
+        indexes = [{} for _ in levels]
+        rows = {}
+        flat = array.array('i')
+        duplicates = []
+        for line in itertools.chain([line], file):
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] in ('Taxon:', 'Coefficients:'):
+                raise ValueError(f"{popfile}: {fields[0]} after the first "
+                                 "species")
+            try:
+                values = taxa_of(fields)
+            except IndexError:
+                raise ValueError(f"{popfile}: {fields[0]} has fewer than "
+                                 f"{width} taxa") from None
+            if missing == 'y' and '/' in values:
+                values = fill_missing(values)
+
+            codes = [index.setdefault(value, len(index))
+                     for index, value in zip(indexes, values)]
+            row = rows.get(fields[0])
+            if row is None:
+                rows[fields[0]] = len(rows)
+                flat.extend(codes)
+            else:
+                duplicates.append(fields[0])
+                flat[row * width:(row + 1) * width] = array.array('i', codes)
+
+    codes = np.frombuffer(flat, dtype=np.int32).reshape(len(rows), width)
+    names = [list(index) for index in indexes]
+    if duplicates:
+        # repeated listings may have left taxa no species belongs to
+        codes = codes.copy()
+        for column in range(width):
+            codes[:, column], names[column] = first_appearance(
+                codes[:, column], names[column])
+    return levels, list(rows), codes, names, coefficients, duplicates
+
+
+def path_lengths(levels, names):
+    """
+    Path lengths from the number of taxa at each level of the population.
+
+    names lists the taxa of each level. Returns (coef, lengths, taxa): the
+    distinctness weight of a pair of species first split at each level,
+    the length of each step and the number of taxa at each level. As in
+    the original PhyRe a taxon name also used at the level above is not
+    counted again.
+    """
+    taxa = {}
+    above = set()
+    for level, level_names in zip(levels, names):
+        level_names = set(level_names)
+        taxa[level] = len(level_names - above)
+        above = level_names
+
+    n = [1.0] + [float(taxa[level]) for level in levels]
+    raw = []
+    for i in range(len(n) - 1):
+        if n[i] > n[i + 1]:
+            raw.append(1)
+        else:
+            raw.append(1 - n[i] / n[i + 1])
+
+    # a single taxon at every level has no path lengths at all
+    scale = 100 / sum(raw) if sum(raw) else 0
+    coef, lengths = coefficients_of(levels, [c * scale for c in raw])
+    return coef, lengths, taxa
+
+
+def coefficients_of(levels, lengths):
+    """ (coef, lengths) per level from the path length of each step """
+    coef = {}
+    steps = {}
+    for i, level in enumerate(levels):
+        coef[level] = sum(lengths[i:])
+        steps[level] = lengths[i]
+    return coef, steps
+
+
+def source_key(popfile, missing, pathlengths):
+    """ What identifies the parse of a population file """
+    stat = os.stat(popfile)
+    return {'popfile': os.path.abspath(popfile),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'missing': missing,
+            'pathlengths': pathlengths}
+
+
+class Population:
+    """
+    A population master list, read and coded once.
+
+    Holds the taxonomic levels, the species in file order, their species x
+    level matrix of taxon codes, the taxon names of the codes and the path
+    length coefficients. It can be saved to and loaded from a .npz file.
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    # pylint: disable=too-many-positional-arguments
+    def __init__(self, levels, species, codes, names, coef, lengths, taxa,
+                 duplicates=(), source=None):
+        self.levels = list(levels)
+        self.species = list(species)
+        self.codes = codes
+        self.names = [list(level) for level in names]
+        self.coef = dict(coef)
+        self.lengths = dict(lengths)
+        self.taxa = dict(taxa)
+        self.duplicates = list(duplicates)
+        self.source = source
+        self.rows = {name: row for row, name in enumerate(self.species)}
+
+    @classmethod
+    def read(cls, popfile, missing='n', pathlengths='n'):
+        """
+        Parse and code a population master list.
+
+        With pathlengths 'y' the path lengths come from its Coefficients:
+        line instead of from the number of taxa at each level.
+        """
+        levels, species, codes, names, coefficients, duplicates = \
+            parse_population(popfile, missing)
+        coef, lengths, taxa = path_lengths(levels, names)
+        if pathlengths == 'y':
+            if coefficients is None:
+                raise ValueError(f"{popfile} has no Coefficients: line")
+            coef, lengths = coefficients_of(levels, coefficients)
+        return cls(levels, species, codes, names, coef, lengths, taxa,
+                   duplicates, source_key(popfile, missing, pathlengths))
+
+    def save(self, filename):
+        """ Write the coded population to a .npz file, atomically """
+        meta = {'version': POPULATION_VERSION,
+                'levels': self.levels,
+                'coef': self.coef,
+                'lengths': self.lengths,
+                'taxa': self.taxa,
+                'duplicates': self.duplicates,
+                'source': self.source}
+        arrays = {f'names_{column}': np.array(names, dtype=str)
+                  for column, names in enumerate(self.names)}
+        temp_file = filename + '.tmp'
+        with open(temp_file, 'wb') as file:
+            np.savez(file, meta=np.array(json.dumps(meta)),
+                     species=np.array(self.species, dtype=str),
+                     codes=self.codes, **arrays)
+        os.replace(temp_file, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a population written by save(), None if it is unusable """
+        try:
+            with np.load(filename) as npz:
+                arrays = dict(npz.items())
+            meta = json.loads(str(arrays['meta']))
+        except (OSError, ValueError, KeyError):
+            # including FileNotFoundError, when there is no cache yet
+            return None
+        if meta.get('version') != POPULATION_VERSION:
+            return None
+        names = [arrays[f'names_{column}'].tolist()
+                 for column in range(len(meta['levels']))]
+        return cls(meta['levels'], arrays['species'].tolist(),
+                   arrays['codes'], names, meta['coef'], meta['lengths'],
+                   meta['taxa'], meta['duplicates'], meta['source'])
+
+    @classmethod
+    def cached(cls, popfile, cache, missing='n', pathlengths='n'):
+        """
+        The population of popfile, from cache when it is still current.
+
+        The cache is rewritten whenever popfile changed since it was saved
+        or was read with other options.
+        """
+        saved = cls.load(cache)
+        if saved is not None and \
+                saved.source == source_key(popfile, missing, pathlengths):
+            return saved
+        fresh = cls.read(popfile, missing, pathlengths)
+        fresh.save(cache)
+        return fresh
+
+    def rows_of(self, species):
+        """ The population rows of the named species """
+        return np.array([self.rows[name] for name in species],
+                        dtype=np.int64)
+
+
+def load_population(popfile, missing='n', pathlengths='n', cache=None):
+    """ The Population of a master list, through a .npz cache if given """
+    if cache:
+        return Population.cached(popfile, cache, missing, pathlengths)
+    return Population.read(popfile, missing, pathlengths)
+
+
+def read_sample(samplefile):
+    """ The species listed in a sample file, each once, in file order """
+    species = {}
+    with open(samplefile) as file:
+        for line in file:
+            fields = line.split()
+            if fields and fields[0] not in ('Taxon:', 'Coefficients:'):
+                species[fields[0]] = None
+    return list(species)
+
+
+def load_sample(pop, samplefile):
+    """ The population rows of the species listed in samplefile """
+    return pop.rows_of(read_sample(samplefile))
+
+
+def sample_rows(pop, sample):
+    """ Population rows for a sample of rows or of species names """
+    if isinstance(sample, np.ndarray):
+        return sample
+    return pop.rows_of(sample)
+
+
+def taxon_counts(column, taxa):
+    """ The distinct taxon codes in column and how often each occurs """
+    if len(column) * 8 >= taxa:
+        counts = np.bincount(column, minlength=taxa)
+        codes = np.flatnonzero(counts)
+        return codes, counts[codes]
+    # a small sample of a big population, sorting beats a huge bincount
+    return np.unique(column, return_counts=True)
+
+
+def level_counts(pop, rows):
+    """ (codes, counts) of the taxa of the population rows at every level """
+    block = pop.codes[rows]
+    return [taxon_counts(block[:, column], len(pop.names[column]))
+            for column in range(len(pop.levels))]
+
+
+def pair_counts(counts, n):
+    """ Ordered pairs of species in different taxa, per level """
+    return [n * n - int(np.dot(number, number)) for _, number in counts]
+
+
+def distinctness(pop, pairs, n):
+    """ (AvTD, VarTD) from the pairs in different taxa at each level """
+    total = 0
+    squares = 0
+    above = 0
+    for level, pairs_at in zip(pop.levels, pairs):
+        total += (pairs_at - above) * pop.coef[level]
+        squares += (pairs_at - above) * pop.coef[level] ** 2
+        above = pairs_at
+    n = n * (n - 1)
+    mean = total / n
+    return mean, (squares - ((mean * n) ** 2) / n) / n
+
+
+def avtd(pop, sample):
+    """ Average taxonomic distinctness of a sample of the population """
+    rows = sample_rows(pop, sample)
+    return distinctness(pop, pair_counts(level_counts(pop, rows), len(rows)),
+                        len(rows))[0]
+
+
+def vartd(pop, sample):
+    """ Variation in taxonomic distinctness of a sample of the population """
+    rows = sample_rows(pop, sample)
+    return distinctness(pop, pair_counts(level_counts(pop, rows), len(rows)),
+                        len(rows))[1]
+
+
+def max_spread_pairs(taxa, n):
+    """
+    Pairs in different taxa at each level when n species are spread out.
+
+    The species are dealt round robin into the taxa of the lowest level,
+    and the taxa of each level round robin into those of the level above,
+    each level's list of taxa reversed before it is dealt, as the TaxMax
+    lists of the original PhyRe were. Only the size of every taxon is
+    tracked, so each level costs O(taxa) whatever n is.
+    """
+    pairs = []
+    sizes = None
+    for k in reversed(taxa):
+        if sizes is None:
+            sizes = np.full(k, n // k, dtype=np.int64)
+            sizes[:n % k] += 1
+        else:
+            # taxon i of this level gets taxa i, i + k, ... of the one below
+            dealt = np.zeros(-(-len(sizes) // k) * k, dtype=np.int64)
+            dealt[:len(sizes)] = sizes
+            sizes = dealt.reshape(-1, k).sum(axis=0)
+        sizes = sizes[::-1]
+        pairs.append(n * n - int(np.dot(sizes, sizes)))
+    return pairs[::-1]
+
+
+def imbalance(pop, taxa, n, mean):
+    """
+    von Euler's index of imbalance of n species in taxa taxa per level.
+
+    TDmin puts all but one species of each level in one taxon, TDmax
+    shares the species out over the taxa of each level as evenly as the
+    level below allows. EI is nan when the two are the same.
+    """
+    td_min = 0
+    above = 0
+    for level, k in zip(pop.levels, taxa):
+        pairs = (k - 1) * (n - k + 1) * 2 + (k - 1) * (k - 2)
+        td_min += pop.coef[level] * (pairs - above)
+        above = pairs
+    td_min /= (n * (n - 1))
+
+    td_max = 0
+    above = 0
+    for level, pairs in zip(pop.levels, max_spread_pairs(taxa, n)):
+        td_max += (pairs - above) * pop.coef[level]
+        above = pairs
+    td_max /= (n * (n - 1))
+
+    if td_max == td_min:
+        # too few species for the taxa to be arranged in different ways
+        return {'EI': float('nan'), 'TDmin': td_min, 'TDmax': td_max}
+    return {'EI': (td_max - mean) / (td_max - td_min),
+            'TDmin': td_min,
+            'TDmax': td_max}
+
+
+def euler_index(pop, sample):
+    """ von Euler's index of imbalance of a sample, with TDmin and TDmax """
+    rows = sample_rows(pop, sample)
+    counts = level_counts(pop, rows)
+    mean = distinctness(pop, pair_counts(counts, len(rows)), len(rows))[0]
+    return imbalance(pop, [len(codes) for codes, _ in counts], len(rows),
+                     mean)
+
+
+def evaluate(pop, sample):
+    """
+    Everything the PhyRe report shows about one sample.
+
+    Returns a dict with the 'atd', 'vtd' and 'euler' results, the sample
+    size 'n', the pairs in different taxa at each level 'N' and the count
+    of each taxon at each level 'taxon'.
+    """
+    rows = sample_rows(pop, sample)
+    counts = level_counts(pop, rows)
+    pairs = pair_counts(counts, len(rows))
+    mean, variance = distinctness(pop, pairs, len(rows))
+    taxa = {}
+    for column, (level, (codes, number)) in enumerate(zip(pop.levels,
+                                                          counts)):
+        names = pop.names[column]
+        taxa[level] = {names[code]: count for code, count
+                       in zip(codes.tolist(), number.tolist())}
+    return {'atd': mean,
+            'vtd': variance,
+            'euler': imbalance(pop, [len(codes) for codes, _ in counts],
+                               len(rows), mean),
+            'N': dict(zip(pop.levels, pairs)),
+            'n': len(rows),
+            'taxon': taxa}
+
+
+def _init_pool(pop):
+    """ Give a pool worker process its population """
+    global _POOL_POPULATION  # pylint: disable=global-statement
+    _POOL_POPULATION = pop
+
+
+def _evaluate_file(samplefile):
+    """ evaluate() a sample file in a pool worker """
+    return evaluate(_POOL_POPULATION,
+                    load_sample(_POOL_POPULATION, samplefile))
+
+
+def _pool(pop, workers):
+    """ A process pool whose workers all hold pop """
+    return mp.Pool(workers, initializer=_init_pool, initargs=(pop,))
+
+
+def analyze(pop, files, workers=1):
+    """
+    evaluate() every sample file against the population.
+
+    Returns the results keyed by the file names up to the first dot. With
+    workers above 1 the files are shared out over a process pool.
+    """
+    names = [filename.split('.')[0] for filename in files]
+    if workers == 1 or len(files) < 2:
+        return {name: evaluate(pop, load_sample(pop, filename))
+                for name, filename in zip(names, files)}
+    with _pool(pop, workers) as pool:
+        return dict(zip(names, pool.map(_evaluate_file, files)))
+
+
+def draw_samples(rng, species, d, count):
+    """
+    A count x d matrix of rows, each d distinct species out of species.
+
+    Rows are drawn with replacement in one go and only the rare rows that
+    picked a species twice are drawn again.
+    """
+    rows = rng.integers(0, species, size=(count, d))
+    rows.sort(axis=1)
+    repeats = np.flatnonzero((rows[:, 1:] == rows[:, :-1]).any(axis=1))
+    for row in repeats:
+        rows[row] = np.sort(rng.choice(species, d, replace=False))
+    return rows
+
+
+def batch_pair_counts(pop, rows):
+    """
+    Ordered pairs of species in different taxa, per sample and level.
+
+    rows is a samples x d matrix of population rows. For every level the
+    taxon codes of each sample are sorted, so sum(count**2) is the sum of
+    2 * rank + 1 over the rank of each species within its run of equal
+    codes. Returns a samples x levels matrix.
+    """
+    count, d = rows.shape
+    codes = pop.codes[rows]
+    position = np.arange(d)
+    pairs = np.empty((count, len(pop.levels)), dtype=np.int64)
+    for column in range(len(pop.levels)):
+        ordered = np.sort(codes[:, :, column], axis=1)
+        start = np.ones(ordered.shape, dtype=bool)
+        start[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+        first = np.where(start, position, 0)
+        np.maximum.accumulate(first, axis=1, out=first)
+        same = (2 * (position - first) + 1).sum(axis=1)
+        pairs[:, column] = d * d - same
+    return pairs
+
+
+def batch_distinctness(pop, rows):
+    """ AvTD and VarTD arrays of the samples x d matrix of population rows """
+    d = rows.shape[1]
+    pairs = batch_pair_counts(pop, rows)
+    # pairs in different taxa at each level but in the same ones above it
+    pairs[:, 1:] -= pairs[:, :-1].copy()
+    weights = np.array([pop.coef[level] for level in pop.levels])
+    n = d * (d - 1)
+    mean = pairs @ weights / n
+    return mean, (pairs @ weights ** 2 - (mean * n) ** 2 / n) / n
+
+
+def new_seed():
+    """ A fresh random seed, to report so a funnel can be run again """
+    return np.random.SeedSequence().entropy
+
+
+def funnel_jobs(p, d1, d2, seed):
+    """
+    Split the permutations of every dimension into blocks.
+
+    Each block gets its own random stream, spawned from seed by its
+    dimension and block number, so the samples drawn do not depend on how
+    many workers share out the blocks.
+    """
+    for d in range(d1, d2 + 1):
+        for block, start in enumerate(range(0, p, FUNNEL_BLOCK)):
+            yield (d, min(FUNNEL_BLOCK, p - start),
+                   np.random.SeedSequence(seed, spawn_key=(d, block)))
+
+
+def permutation_block(pop, job):
+    """ AvTD and VarTD of a block of random samples of d species """
+    d, count, seed = job
+    rng = np.random.default_rng(seed)
+    rows = draw_samples(rng, len(pop.species), d, count)
+    return (d,) + batch_distinctness(pop, rows)
+
+
+def _permutation_block(job):
+    """ permutation_block() in a pool worker """
+    return permutation_block(_POOL_POPULATION, job)
+
+
+def run_blocks(pop, jobs, workers=1):
+    """ Yield the results of the permutation blocks in order """
+    if workers == 1:
+        for job in jobs:
+            yield permutation_block(pop, job)
+        return
+    with _pool(pop, workers) as pool:
+        yield from pool.imap(_permutation_block, jobs)
+
+
+def confidence_limits(avtds, vartds):
+    """
+    The funnel values of the AvTD and VarTD arrays of p samples.
+
+    Returns (AvTD 5%, mean, 95%, max) and (VarTD min, 5%, mean, 95%).
+    """
+    p = len(avtds)
+    avtds = np.sort(avtds)
+    vartds = np.sort(vartds)
+    return ((avtds[int(.05 * p)], avtds.mean(), avtds[int(.95 * p)],
+             avtds[-1]),
+            (vartds[0], vartds[int(.05 * p)], vartds.mean(),
+             vartds[int(.95 * p)]))
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def funnel(pop, p, d1, d2, workers=1, seed=None):
+    """
+    Confidence limits of AvTD and VarTD for random samples of d species.
+
+    Yields (d, AvTD limits, VarTD limits) as each dimension from d1 to d2
+    completes, see confidence_limits(). The p samples of each dimension
+    are drawn in blocks of FUNNEL_BLOCK, spread over workers processes.
+    The same seed gives the same limits whatever the number of workers.
+    """
+    results = {}
+    for d, avtds, vartds in run_blocks(pop, funnel_jobs(p, d1, d2, seed),
+                                       workers):
+        limits = results.setdefault(d, ([], []))
+        limits[0].append(avtds)
+        limits[1].append(vartds)
+        if sum(map(len, limits[0])) < p:
+            continue
+        avtds, vartds = map(np.concatenate, results.pop(d))
+        yield (d,) + confidence_limits(avtds, vartds)
+
+
+def quantile_error(values, q):
+    """
+    Standard error of the q quantile of the sorted array values.
+
+    Half the spread of the order statistics one binomial standard
+    deviation either side of rank q * n, which needs no density estimate.
+    """
+    n = len(values)
+    spread = np.sqrt(q * (1 - q) / n)
+    low = values[max(0, int((q - spread) * n))]
+    high = values[min(n - 1, int(np.ceil((q + spread) * n)))]
+    return (high - low) / 2
+
+
+def limits_error(avtds, vartds):
+    """ The largest standard error of the 5% and 95% AvTD and VarTD limits """
+    return max(quantile_error(np.sort(values), q)
+               for values in (avtds, vartds) for q in (.05, .95))
+
+
+def adaptive_jobs(p, d, seed):
+    """
+    Split the permutations of one dimension into growing blocks.
+
+    Blocks start at ADAPTIVE_BLOCK and double the permutations drawn so
+    far, up to FUNNEL_BLOCK at a time, so convergence is checked often
+    while few permutations are drawn and rarely once there are many.
+    """
+    start = 0
+    for block in itertools.count():
+        if start >= p:
+            return
+        count = min(max(ADAPTIVE_BLOCK, start), FUNNEL_BLOCK, p - start)
+        yield d, count, np.random.SeedSequence(seed, spawn_key=(d, block))
+        start += count
+
+
+def block_rounds(pop, jobs, pool=None, workers=1):
+    """ Yield the results of the permutation blocks, workers at a time """
+    while True:
+        batch = list(itertools.islice(jobs, workers))
+        if not batch:
+            return
+        if pool is None:
+            yield from (permutation_block(pop, job) for job in batch)
+        else:
+            yield from pool.map(_permutation_block, batch)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def adaptive_funnel(pop, p, d1, d2, tolerance, workers=1, seed=None):
+    """
+    funnel() that stops each dimension once its limits have converged.
+
+    The samples of a dimension are drawn in the blocks of adaptive_jobs(),
+    up to p. It stops after the first block that brings the standard error
+    of its 5% and 95% AvTD and VarTD limits down to tolerance. Yields
+    (d, permutations used, AvTD limits, VarTD limits). Blocks run workers
+    at a time but are checked in order, so the same seed gives the same
+    result whatever the number of workers.
+    """
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if workers > 1:
+            pool = stack.enter_context(_pool(pop, workers))
+        for d in range(d1, d2 + 1):
+            avtds = vartds = np.empty(0)
+            jobs = adaptive_jobs(p, d, seed)
+            for _, block_avtds, block_vartds in block_rounds(pop, jobs, pool,
+                                                             workers):
+                avtds = np.concatenate([avtds, block_avtds])
+                vartds = np.concatenate([vartds, block_vartds])
+                if limits_error(avtds, vartds) <= tolerance:
+                    break
+            yield (d, len(avtds)) + confidence_limits(avtds, vartds)
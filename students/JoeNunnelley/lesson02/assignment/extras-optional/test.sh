@@ -0,0 +1,10 @@
+#! /usr/bin/env bash
+
+echo 'Run Flake8'
+python3 -m flake8 PhyRe.py phyre_api.py benchmark.py generate_taxonomy.py
+echo 'Run Pylint'
+python3 -m pylint PhyRe.py phyre_api.py benchmark.py generate_taxonomy.py
+
+
+echo 'Run Tests'
+python3 -m unittest test_phyre.py
@@ -0,0 +1,530 @@
+#! /usr/bin/env python3
+""" The PhyRe Test Suite """
+
+import math
+import os
+import random
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+import benchmark
+import generate_taxonomy
+import phyre_api
+import PhyRe
+
+
+LEVELS = ['Phylum', 'Class', 'Order', 'Family', 'Genus']
+
+
+def write_population(directory, species=300, breadth=3, seed=2):
+    """ Write a random population master list and return its name """
+    rng = random.Random(seed)
+    filename = os.path.join(directory, 'population.txt')
+    with open(filename, 'w') as file:
+        file.write('Taxon: ' + ' '.join(LEVELS) + '\n')
+        for number in range(species):
+            path = []
+            for level in LEVELS:
+                path.append(f'{level[0]}{rng.randrange(breadth)}')
+            names = ['_'.join(path[:i + 1]) for i in range(len(path))]
+            file.write(f'sp{number} ' + ' '.join(names) + '\n')
+    return filename
+
+
+def write_sample(directory, species, name='sample.txt'):
+    """ Write a sample file listing species and return its name """
+    filename = os.path.join(directory, name)
+    with open(filename, 'w') as file:
+        file.write('Taxon: ' + ' '.join(LEVELS) + '\n')
+        for one in species:
+            file.write(one + '\n')
+    return filename
+
+
+def records_of(pop):
+    """ The taxon of every species at every level, as the original kept """
+    return {species: {level: pop.names[column][pop.codes[row, column]]
+                      for column, level in enumerate(pop.levels)}
+            for row, species in enumerate(pop.species)}
+
+
+def reference_atd(pop, records, sample):
+    """ The dict of dicts ATDmean and ATDvariance of the original PhyRe """
+    taxa = {}
+    for t in pop.levels:
+        x = [records[i][t] for i in sample]
+        taxa[t] = {i: x.count(i) for i in set(x)}
+    atd = 0
+    vtd = 0
+    n = 0
+    pairs = {}
+    for t in pop.levels:
+        pairs[t] = sum(taxa[t][i] * taxa[t][j]
+                       for i in taxa[t] for j in taxa[t] if i != j)
+        atd += (pairs[t] - n) * pop.coef[t]
+        vtd += (pairs[t] - n) * pop.coef[t] ** 2
+        n = pairs[t]
+    n = len(sample) * (len(sample) - 1)
+    atd /= n
+    return atd, (vtd - ((atd * n) ** 2) / n) / n, pairs, taxa
+
+
+def reference_euler(pop, taxa, sample, atd):
+    """ The TaxMax list building euler() of the original PhyRe """
+    taxon = list(pop.levels)
+    n = len(sample)
+    td_min = 0
+    above = 0
+    for t in taxon:
+        k = len(taxa[t])
+        td_min += pop.coef[t] * (((k - 1) * (n - k + 1) * 2 +
+                                  (k - 1) * (k - 2)) - above)
+        above += ((k - 1) * (n - k + 1) * 2 + (k - 1) * (k - 2)) - above
+    td_min /= (n * (n - 1))
+
+    taxon.reverse()
+    tax_max = {}
+    for t in taxon:
+        tax_max[t] = []
+        if taxon.index(t) == 0:
+            for i in range(len(taxa[t])):
+                tax_max[t].append([sample[j]
+                                   for j in range(i, n, len(taxa[t]))])
+        else:
+            s = taxon[taxon.index(t) - 1]
+            for i in range(len(taxa[t])):
+                tax_max[t].append([])
+                for j in range(i, len(taxa[s]), len(taxa[t])):
+                    tax_max[t][i] += tax_max[s][j]
+        tax_max[t].reverse()
+    taxon.reverse()
+
+    td_max = 0
+    above = 0
+    for t in taxon:
+        pairs = sum(len(tax_max[t][i]) * len(tax_max[t][j])
+                    for i in range(len(tax_max[t]))
+                    for j in range(len(tax_max[t])) if i != j)
+        td_max += (pairs - above) * pop.coef[t]
+        above = pairs
+    td_max /= (n * (n - 1))
+    if td_max == td_min:
+        return {'EI': math.nan, 'TDmin': td_min, 'TDmax': td_max}
+    return {'EI': (td_max - atd) / (td_max - td_min),
+            'TDmin': td_min, 'TDmax': td_max}
+
+
+class PopulationCase(TestCase):
+    """ Base class for tests on a random population in a temp directory """
+    species = 300
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.popfile = write_population(self.directory.name, self.species)
+        self.pop = phyre_api.load_population(self.popfile)
+        self.records = records_of(self.pop)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+
+class TestKernels(PopulationCase):
+    """ Class for testing the coded AvTD, VarTD and euler """
+    def test_matches_reference(self):
+        """ AvTD, VarTD, euler and the taxa agree with the dict version """
+        rng = random.Random(5)
+        for size in [2, 3, 10, 50, 300]:
+            for _ in range(5):
+                sample = rng.sample(self.pop.species, size)
+                atd, vtd, pairs, taxa = reference_atd(self.pop, self.records,
+                                                      sample)
+                self.assertAlmostEqual(phyre_api.avtd(self.pop, sample), atd,
+                                       places=9)
+                self.assertAlmostEqual(phyre_api.vartd(self.pop, sample),
+                                       vtd, places=6)
+
+                result = phyre_api.evaluate(self.pop, sample)
+                self.assertEqual(result['N'], pairs)
+                self.assertEqual(result['taxon'], taxa)
+                self.assertEqual(result['n'], size)
+                expected = reference_euler(self.pop, taxa, sample, atd)
+                for name, value in phyre_api.euler_index(self.pop,
+                                                         sample).items():
+                    if math.isnan(expected[name]):
+                        self.assertTrue(math.isnan(value))
+                    else:
+                        self.assertAlmostEqual(value, expected[name],
+                                               places=9)
+
+    def test_imbalance_sizes(self):
+        """ The arithmetic TDmax agrees with building the TaxMax lists """
+        rng = random.Random(8)
+        for _ in range(200):
+            n = rng.randrange(2, 60)
+            taxa = sorted(rng.randrange(1, n + 1) for _ in LEVELS)
+            if rng.random() < 0.2:
+                rng.shuffle(taxa)
+            fake = {level: dict.fromkeys(range(k))
+                    for level, k in zip(LEVELS, taxa)}
+            expected = reference_euler(self.pop, fake, list(range(n)), 50.0)
+            result = phyre_api.imbalance(self.pop, taxa, n, 50.0)
+            self.assertAlmostEqual(result['TDmax'], expected['TDmax'],
+                                   places=9)
+            self.assertAlmostEqual(result['TDmin'], expected['TDmin'],
+                                   places=9)
+
+    def test_rows_or_names(self):
+        """ A sample can be given as species names or population rows """
+        sample = self.pop.species[:20]
+        rows = self.pop.rows_of(sample)
+        self.assertEqual(phyre_api.avtd(self.pop, sample),
+                         phyre_api.avtd(self.pop, rows))
+        with self.assertRaises(KeyError):
+            self.pop.rows_of(['no such species'])
+
+    def test_sparse_counts(self):
+        """ Sorting and bincount give the same taxon counts """
+        column = self.pop.codes[:10, 4]
+        taxa = len(self.pop.names[4])
+        codes, counts = phyre_api.taxon_counts(column, taxa)
+        self.assertLess(len(column) * 8, taxa)
+        dense = phyre_api.taxon_counts(column, 0)
+        self.assertEqual(codes.tolist(), dense[0].tolist())
+        self.assertEqual(counts.tolist(), dense[1].tolist())
+
+
+class TestFunnel(PopulationCase):
+    """ Class for testing the parallel, batched funnel permutations """
+    def test_same_for_any_workers(self):
+        """ A seed gives the same limits with one or several workers """
+        with patch('phyre_api.FUNNEL_BLOCK', 40):
+            serial = list(phyre_api.funnel(self.pop, 100, 5, 8, seed=11))
+            parallel = list(phyre_api.funnel(self.pop, 100, 5, 8, workers=3,
+                                             seed=11))
+        self.assertEqual(repr(serial), repr(parallel))
+        self.assertEqual([line[0] for line in serial], [5, 6, 7, 8])
+
+    def test_new_seed(self):
+        """ A new seed is a fresh int the funnel accepts """
+        seed = phyre_api.new_seed()
+        self.assertIsInstance(seed, int)
+        self.assertNotEqual(seed, phyre_api.new_seed())
+        self.assertEqual(
+            repr(list(phyre_api.funnel(self.pop, 20, 5, 5, seed=seed))),
+            repr(list(phyre_api.funnel(self.pop, 20, 5, 5, seed=seed))))
+
+    def test_seeds_differ(self):
+        """ Another seed draws other samples """
+        self.assertNotEqual(
+            repr(list(phyre_api.funnel(self.pop, 50, 5, 6, seed=1))),
+            repr(list(phyre_api.funnel(self.pop, 50, 5, 6, seed=2))))
+
+    def test_block_limits(self):
+        """ The batched AvTD and VarTD of a block match the original """
+        seed = np.random.SeedSequence(3)
+        d, atds, vtds = phyre_api.permutation_block(self.pop, (12, 30, seed))
+        self.assertEqual((d, len(atds), len(vtds)), (12, 30, 30))
+
+        rng = np.random.default_rng(seed)
+        rows = phyre_api.draw_samples(rng, len(self.pop.species), 12, 30)
+        for row, atd, vtd in zip(rows, atds, vtds):
+            sample = [self.pop.species[number] for number in row]
+            self.assertEqual(len(set(sample)), 12)
+            expected = reference_atd(self.pop, self.records, sample)
+            self.assertAlmostEqual(atd, expected[0], places=9)
+            self.assertAlmostEqual(vtd, expected[1], places=6)
+
+    def test_draw_distinct(self):
+        """ Samples never repeat a species, even from a tiny population """
+        rng = np.random.default_rng(0)
+        rows = phyre_api.draw_samples(rng, 10, 8, 200)
+        self.assertTrue((np.diff(rows, axis=1) > 0).all())
+
+    @patch('phyre_api.FUNNEL_BLOCK', 40)
+    @patch('phyre_api.ADAPTIVE_BLOCK', 10)
+    def test_adaptive_stops(self):
+        """ Dimensions stop at the tolerance and never go beyond p """
+        loose = list(phyre_api.adaptive_funnel(self.pop, 200, 5, 7, 100,
+                                               seed=4))
+        self.assertEqual([line[:2] for line in loose],
+                         [(5, 10), (6, 10), (7, 10)])
+        strict = list(phyre_api.adaptive_funnel(self.pop, 200, 5, 7, 0,
+                                                seed=4))
+        self.assertEqual([line[1] for line in strict], [200, 200, 200])
+        self.assertEqual(
+            [count for _, count, _ in phyre_api.adaptive_jobs(200, 5, 4)],
+            [10, 10, 20, 40, 40, 40, 40])
+
+    @patch('phyre_api.FUNNEL_BLOCK', 40)
+    @patch('phyre_api.ADAPTIVE_BLOCK', 10)
+    def test_adaptive_same_for_any_workers(self):
+        """ A seed stops at the same permutations with any workers """
+        serial = list(phyre_api.adaptive_funnel(self.pop, 200, 5, 8, 1,
+                                                seed=11))
+        parallel = list(phyre_api.adaptive_funnel(self.pop, 200, 5, 8, 1,
+                                                  workers=3, seed=11))
+        self.assertEqual(repr(serial), repr(parallel))
+
+    def test_quantile_error(self):
+        """ The quantile error shrinks like one over the square root of n """
+        values = np.sort(np.random.default_rng(1).normal(size=40000))
+        error = phyre_api.quantile_error(values, .05)
+        # asymptotic sqrt(q (1 - q) / n) / density at the 5% quantile
+        self.assertAlmostEqual(error, 0.0106, delta=0.002)
+        self.assertGreater(phyre_api.quantile_error(values[::16], .05),
+                           3 * error)
+
+
+class TestPopulation(PopulationCase):
+    """ Class for testing the reusable, saved Population """
+    def assert_same(self, first, second):
+        """ Two populations hold the same coded data """
+        for name in ['levels', 'species', 'names', 'coef', 'lengths',
+                     'taxa', 'duplicates', 'source']:
+            self.assertEqual(getattr(first, name), getattr(second, name))
+        self.assertEqual(first.codes.tolist(), second.codes.tolist())
+
+    def test_save_and_load(self):
+        """ A saved population loads back unchanged """
+        cache = os.path.join(self.directory.name, 'pop.npz')
+        self.pop.save(cache)
+        self.assert_same(phyre_api.Population.load(cache), self.pop)
+
+    def test_unusable_cache(self):
+        """ Missing or broken cache files are ignored """
+        cache = os.path.join(self.directory.name, 'pop.npz')
+        self.assertIsNone(phyre_api.Population.load(cache))
+        with open(cache, 'w') as file:
+            file.write('not a npz file')
+        self.assertIsNone(phyre_api.Population.load(cache))
+
+    def test_cached(self):
+        """ The cache skips parsing until the master list changes """
+        cache = os.path.join(self.directory.name, 'pop.npz')
+        first = phyre_api.load_population(self.popfile, cache=cache)
+        with patch('phyre_api.parse_population') as read:
+            second = phyre_api.load_population(self.popfile, cache=cache)
+            read.assert_not_called()
+        self.assert_same(first, second)
+
+        with open(self.popfile, 'a') as file:
+            file.write('extra P0 P0_C0 P0_C0_O0 P0_C0_O0_F0 P0_C0_O0_F0_G9\n')
+        third = phyre_api.load_population(self.popfile, cache=cache)
+        self.assertEqual(third.species[-1], 'extra')
+        self.assertEqual(phyre_api.Population.load(cache).species[-1],
+                         'extra')
+
+    def test_parallel_samples(self):
+        """ Sample files give the same results with a process pool """
+        rng = random.Random(4)
+        files = [write_sample(self.directory.name,
+                              rng.sample(self.pop.species, size),
+                              f'{size}.txt')
+                 for size in [5, 20, 80]]
+        serial = phyre_api.analyze(self.pop, files)
+        parallel = phyre_api.analyze(self.pop, files, workers=2)
+        self.assertEqual(serial, parallel)
+        self.assertEqual([result['n'] for result in serial.values()],
+                         [5, 20, 80])
+
+    def test_load_sample(self):
+        """ Sample files give population rows, each species once """
+        filename = write_sample(self.directory.name, ['sp3', 'sp1', 'sp3'])
+        self.assertEqual(phyre_api.load_sample(self.pop, filename).tolist(),
+                         [3, 1])
+
+
+class TestParsing(TestCase):
+    """ Class for testing the population parsing and path lengths """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, lines):
+        """ Write a population file from lines """
+        filename = os.path.join(self.directory.name, 'pop.txt')
+        with open(filename, 'w') as file:
+            file.write('\n'.join(lines) + '\n')
+        return filename
+
+    def test_missing_and_duplicates(self):
+        """ '/' repeats the taxon above and duplicates are reported """
+        filename = self.write(['Taxon: Order Family Genus',
+                               'a O1 F1 G1',
+                               'b O1 / G2',
+                               'a O2 F2 G3',
+                               ''])
+        pop = phyre_api.load_population(filename, missing='y')
+        self.assertEqual(pop.duplicates, ['a'])
+        self.assertEqual(pop.species, ['a', 'b'])
+        self.assertEqual(pop.names[1], ['F2', 'O1'])
+        self.assertEqual(pop.codes.tolist(), [[0, 0, 0], [1, 1, 1]])
+
+    def test_single_level(self):
+        """ A master list with one taxonomic level """
+        pop = phyre_api.load_population(self.write(['Taxon: Genus', 'a G1',
+                                                    'b G2', 'c G1']))
+        self.assertEqual(pop.codes.tolist(), [[0], [1], [0]])
+        self.assertEqual(pop.names, [['G1', 'G2']])
+
+    def test_bad_files(self):
+        """ Malformed master lists raise ValueError """
+        for lines in [['a O1 F1 G1'],
+                      ['Taxon: Order Family Genus', 'a O1 F1'],
+                      ['Taxon: Order Family Genus', 'a O1 F1 G1',
+                       'Coefficients: 50 30 20']]:
+            with self.assertRaises(ValueError):
+                phyre_api.load_population(self.write(lines))
+
+    def test_path_lengths(self):
+        """ Coefficients add up the path lengths of the lower levels """
+        filename = self.write(['Taxon: Order Family Genus',
+                               'a O1 F1 G1',
+                               'b O1 F1 G2',
+                               'c O1 F2 G3',
+                               'd O2 F3 G4'])
+        pop = phyre_api.load_population(filename)
+        self.assertEqual(pop.taxa, {'Order': 2, 'Family': 3, 'Genus': 4})
+        raw = [1 - 1 / 2, 1 - 2 / 3, 1 - 3 / 4]
+        self.assertAlmostEqual(pop.lengths['Family'],
+                               raw[1] * 100 / sum(raw))
+        self.assertAlmostEqual(pop.coef['Order'], 100)
+
+    def test_coefficients_line(self):
+        """ A Coefficients: line gives the path lengths directly """
+        filename = self.write(['Taxon: Order Family Genus',
+                               'Coefficients: 50 30 20',
+                               'a O1 F1 G1'])
+        pop = phyre_api.load_population(filename, pathlengths='y')
+        self.assertEqual(pop.coef, {'Order': 100, 'Family': 50,
+                                    'Genus': 20})
+        self.assertEqual(pop.lengths['Family'], 30)
+
+    def test_no_coefficients_line(self):
+        """ -l y without a Coefficients: line is an error """
+        filename = self.write(['Taxon: Order Family Genus', 'a O1 F1 G1'])
+        with self.assertRaises(ValueError):
+            phyre_api.load_population(filename, pathlengths='y')
+
+
+class TestMain(TestCase):
+    """ Class for testing the command line program """
+    def test_outputs(self):
+        """ The sample results and the funnel are written to files """
+        with tempfile.TemporaryDirectory() as directory:
+            popfile = write_population(directory, species=120)
+            species = [f'sp{i}' for i in range(30)]
+            sample = write_sample(directory, species)
+            out = os.path.join(directory, 'run')
+            argv = ['PhyRe.py', sample, popfile, '10', '12',
+                    '-o', out, '-p', '20']
+            with patch('sys.argv', argv):
+                PhyRe.main()
+
+            with open(out + '.out') as file:
+                report = file.read()
+            pop = phyre_api.load_population(popfile)
+            atd = reference_atd(pop, records_of(pop), species)[0]
+            self.assertIn(f"Average taxonomic distinctness      = {atd:.4f}",
+                          report)
+            self.assertIn("von Euler's index of imbalance", report)
+            with open(out + '_funnel.out') as file:
+                funnel = file.read().splitlines()
+            self.assertEqual([line.split()[0] for line in funnel[-3:]],
+                             ['10', '11', '12'])
+
+    def test_adaptive_output(self):
+        """ An adaptive funnel writes the permutations of each dimension """
+        with tempfile.TemporaryDirectory() as directory:
+            popfile = write_population(directory, species=120)
+            sample = write_sample(directory, ['sp1', 'sp2', 'sp3'])
+            out = os.path.join(directory, 'run')
+            argv = ['PhyRe.py', sample, popfile, '10', '11', '-o', out,
+                    '-p', '300', '-a', '1000', '-s', '3']
+            with patch('sys.argv', argv), \
+                    patch('phyre_api.ADAPTIVE_BLOCK', 50):
+                PhyRe.main()
+
+            with open(out + '_funnel.out') as file:
+                funnel = file.read().splitlines()
+            self.assertIn("within 1000.0", funnel[4])
+            self.assertTrue(funnel[-3].endswith('permutations'))
+            self.assertEqual([line.split()[-1] for line in funnel[-2:]],
+                             ['50', '50'])
+
+    def test_batch_with_workers(self):
+        """ A cached, parallel batch run writes every report once """
+        with tempfile.TemporaryDirectory() as directory:
+            popfile = write_population(directory, species=120)
+            files = [write_sample(directory, [f'sp{i}' for i in range(size)],
+                                  f'sample{size}.txt')
+                     for size in [10, 30]]
+            batch = os.path.join(directory, 'batch.txt')
+            with open(batch, 'w') as file:
+                file.write('\n'.join(files) + '\n')
+            out = os.path.join(directory, 'run')
+            argv = ['PhyRe.py', batch, popfile, '10', '11', '-o', out,
+                    '-p', '20', '-b', 'y', '-w', '2', '-k',
+                    os.path.join(directory, 'pop.npz')]
+            for _ in range(2):
+                with patch('sys.argv', argv):
+                    PhyRe.main()
+
+            with open(out + '.out') as file:
+                report = file.read()
+            self.assertEqual(report.count('Output from Average'), 1)
+            self.assertEqual(report.count('Results for sample:'), 2)
+            with open(out + '_funnel.out') as file:
+                self.assertEqual(file.read().count('Confidence limits'), 1)
+
+    def test_funnel_name(self):
+        """ Only the file name is cut at the first underscore """
+        self.assertEqual(PhyRe.funnel_name('/tmp/a_b/run_1'),
+                         '/tmp/a_b/run_funnel.out')
+
+
+class TestBenchmark(TestCase):
+    """ The synthetic taxonomies and the frozen reference values """
+
+    def test_generated_taxonomy(self):
+        """ A generated master list has the asked for shape every time """
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = [generate_taxonomy.write_population(
+                os.path.join(directory, f'{name}.txt'), 500, depth=7,
+                breadth=3, seed=4) for name in 'ab']
+            with open(first) as file_a, open(second) as file_b:
+                self.assertEqual(file_a.read(), file_b.read())
+            pop = phyre_api.Population.read(first)
+            self.assertEqual(pop.levels[-1], 'Level7')
+            self.assertEqual(len(pop.species), 500)
+            self.assertEqual(pop.taxa['Phylum'], 3)
+            self.assertFalse(pop.duplicates)
+
+    def test_reference(self):
+        """ The kernels still give the frozen values for the small size """
+        with tempfile.TemporaryDirectory() as directory:
+            files = {'1000x4x4': benchmark.population_file(directory,
+                                                           '1000x4x4')}
+            self.assertEqual(benchmark.verify(files), [])
+
+    def test_compare(self):
+        """ Changed, missing and NaN values are compared properly """
+        frozen = {'a': [1.0, float('nan')], 'b': {'c': 2}}
+        self.assertEqual(benchmark.compare(frozen, frozen), [])
+        self.assertEqual(benchmark.compare(
+            {'a': [1.0 + 1e-6, 0.0], 'b': {}}, frozen),
+            ['/a/0', '/a/1', '/b/c'])
+        self.assertEqual(benchmark.compare({'a': [1.0]}, frozen),
+                         ['/a', '/b'])
+
+    def test_regressions(self):
+        """ Only medians slower than the tolerance are regressions """
+        previous = [{'kernel': 'avtd', 'size': '1x1x1', 'median': 1.0},
+                    {'kernel': 'vartd', 'size': '1x1x1', 'median': 1.0}]
+        results = [{'kernel': 'avtd', 'size': '1x1x1', 'median': 1.05},
+                   {'kernel': 'vartd', 'size': '1x1x1', 'median': 1.5}]
+        self.assertEqual(benchmark.regressions(results, previous),
+                         [('vartd', '1x1x1', 1.0, 1.5)])
@@ -0,0 +1,251 @@
+#! /usr/bin/env python3
+
+"""
+Numpy columns of rentals and the columnar .npz output
+"""
+import itertools
+import json
+import logging
+import os
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+LOGGER = logging.getLogger()
+# Rentals whose numbers stay below this go into the int64 columns, odder
+# ones have to be checked one at a time.
+COLUMN_LIMIT = 2 ** 31
+# .npz output: the rental ids go in ID_COLUMN, the column kinds in SCHEMA
+ID_COLUMN = 'rental_id'
+SCHEMA = '__schema__'
+# Stands in for a field a rental doesn't have in the .npz columns
+NO_FIELD = object()
+# Floats can hold every int up to this exactly
+FLOAT_INT_LIMIT = 2 ** 53
+
+
+def number_column(numbers):
+    """ An int64 column of numbers and a mask of those that don't fit """
+    if ({type(number) for number in numbers} == {int} and
+            max(map(abs, numbers)) < COLUMN_LIMIT):
+        return np.array(numbers, np.int64), np.zeros(len(numbers), bool)
+    fits = [isinstance(number, int) and not isinstance(number, bool) and
+            abs(number) < COLUMN_LIMIT for number in numbers]
+    return (np.array([number if fit else 0
+                      for number, fit in zip(numbers, fits)], np.int64),
+            ~np.array(fits, bool))
+
+
+def rental_columns(data, ordinal):
+    """
+    Turn a non empty dict of rentals into numpy columns. ordinal gives
+    the day number of a rental date, 0 when it can't be parsed.
+
+    The 'fallback' column flags the rentals that are missing fields or
+    whose values don't fit the int64 columns. They hold placeholder values
+    and have to be checked one at a time.
+    """
+    values = list(data.values())
+    fallback = np.array([not isinstance(value, dict) for value in values])
+    if fallback.any():
+        values = [{} if odd else value
+                  for value, odd in zip(values, fallback.tolist())]
+
+    columns = {}
+    for name in ['price_per_day', 'units_rented']:
+        columns[name], odd = number_column([value.get(name)
+                                            for value in values])
+        fallback |= odd
+    for name in ['rental_start', 'rental_end']:
+        # Only str can parse, anything else (maybe unhashable) becomes ''
+        texts = [text if isinstance(text, str) else ''
+                 for text in (value.get(name) for value in values)]
+        ordinals = {text: ordinal(text) for text in set(texts)}
+        columns[name] = np.fromiter(map(ordinals.get, texts), np.int64,
+                                    len(texts))
+        fallback |= columns[name] == 0
+    fallback |= np.array(['product_code' not in value for value in values])
+    columns['product_code'] = np.array([bool(value.get('product_code'))
+                                        for value in values])
+    columns['fallback'] = fallback
+    return columns
+
+
+def derived_columns(columns):
+    """
+    rejection_reasons() and the derived fields as column operations.
+
+    'missing' and 'invalid' hold the index into MISSING_CHECKS and
+    INVALID_CHECKS of the first check each rental failed, 0 if it passed.
+    """
+    price = columns['price_per_day']
+    units = columns['units_rented']
+    start = columns['rental_start']
+    end = columns['rental_end']
+    derived = {'missing': np.select([price == 0, ~columns['product_code']],
+                                    [1, 2], 0),
+               'invalid': np.select([price < 0, start > end, units <= 0],
+                                    [1, 2, 3], 0),
+               'total_days': end - start}
+    derived['total_price'] = derived['total_days'] * price
+    # Rejected rows can hold negative prices and zero units, their
+    # results are never used
+    with np.errstate(divide='ignore', invalid='ignore'):
+        derived['sqrt_total_price'] = np.sqrt(derived['total_price'])
+        derived['unit_cost'] = derived['total_price'] / units
+    return derived
+
+
+def dictionary_encode(values):
+    """ Split strings into the distinct values and a code for each one """
+    index = {}
+    codes = [index.setdefault(value, len(index)) for value in values]
+    return (np.array(list(index), str),
+            np.array(codes, np.min_scalar_type(max(len(index) - 1, 0))))
+
+
+def encode_column(values):
+    """
+    Turn one column of values into ({array name suffix: array}, kind).
+
+    Numbers and bools are stored natively, ints as int64 unless the column
+    also holds floats. Then they go in a float64 array, with a '.ints' bool
+    array marking the ones that were ints. Strings are dictionary encoded.
+    Anything else, like mixed types or a field some rentals lack (NO_FIELD
+    in values), becomes a dictionary of JSON texts with '' standing for a
+    missing field.
+    """
+    types = {type(value) for value in values}
+    if types == {bool}:
+        return {'': np.array(values, bool)}, 'bool'
+    if types == {int} and max(map(abs, values)) < 2 ** 63:
+        return {'': np.array(values, np.int64)}, 'int'
+    if types in ({int, float}, {float}):
+        if all(abs(value) < FLOAT_INT_LIMIT for value in values
+               if isinstance(value, int)):
+            numbers = np.array(values, np.float64)
+            if int not in types:
+                return {'': numbers}, 'float'
+            ints = np.array([isinstance(value, int) for value in values], bool)
+            return {'': numbers, '.ints': ints}, 'number'
+    # numpy str arrays drop trailing NULs, JSON escapes them
+    if types == {str} and not any(value.endswith('\x00') for value in values):
+        distinct, codes = dictionary_encode(values)
+        return {'.values': distinct, '.codes': codes}, 'str'
+    distinct, codes = dictionary_encode(
+        '' if value is NO_FIELD else json.dumps(value) for value in values)
+    return {'.values': distinct, '.codes': codes}, 'json'
+
+
+def column_arrays(columns):
+    """
+    The arrays save_to_npz() writes for {name: values} columns, the
+    SCHEMA array telling the kind of each column among them.
+    """
+    arrays = {}
+    schema = {}
+    for name, values in columns.items():
+        parts, schema[name] = encode_column(values)
+        for suffix, array in parts.items():
+            if name + suffix in arrays:
+                raise ValueError(f"field {name!r} clashes with the "
+                                 f"{name + suffix!r} array of another field")
+            arrays[name + suffix] = array
+    arrays[SCHEMA] = np.array(json.dumps(schema))
+    return arrays
+
+
+def save_to_npz(filename, items):
+    """
+    this function saves (rental_id, rental) pairs to a columnar .npz file
+
+    Every field becomes a typed array (see encode_column()) that
+    read_column() can load on its own. Only the columns are held in
+    memory, so it can take the streaming output of iter_additional_fields.
+    """
+    ids = []
+    columns = {}
+    for key, value in items:
+        for name, field in value.items():
+            if name not in columns:
+                # Pad for the rentals before this field turned up
+                columns[name] = [NO_FIELD] * len(ids)
+            columns[name].append(field)
+        ids.append(key)
+        if len(value) < len(columns):
+            for column in columns.values():
+                if len(column) < len(ids):
+                    column.append(NO_FIELD)
+    if not ids:
+        LOGGER.warning("Data is invalid. Skipping file writing")
+        return
+    for name in (ID_COLUMN, SCHEMA):
+        if name in columns:
+            raise ValueError(f"rentals can't have a {name!r} field")
+
+    LOGGER.debug("Saving file %s", filename)
+    arrays = column_arrays({ID_COLUMN: ids, **columns})
+    temp_file = filename + '.tmp'
+    with open(temp_file, 'wb') as file:
+        np.savez_compressed(file, **arrays)
+    os.replace(temp_file, filename)
+
+
+def decode_column(npz, kind, name):
+    """
+    Decode a column of an open save_to_npz() file into (values, present).
+
+    present is None when every rental has the field, otherwise a bool
+    array telling the rentals that have it from those that don't.
+    """
+    if kind == 'number':
+        numbers = npz[name]
+        ints = npz[name + '.ints']
+        values = numbers.astype(object)
+        values[ints] = numbers[ints].astype(np.int64).astype(object)
+        return values, None
+    if kind not in ('str', 'json'):
+        return npz[name], None
+    values = npz[name + '.values']
+    codes = npz[name + '.codes']
+    if kind == 'str':
+        return values[codes], None
+    decoded = np.empty(len(values), object)
+    for code, value in enumerate(values.tolist()):
+        decoded[code] = json.loads(value) if value else None
+    return decoded[codes], (values != '')[codes]
+
+
+def read_column(filename, name):
+    """
+    Load a single column of a save_to_npz() file as a numpy array.
+
+    Only that column is read and decompressed. 'json' columns come back
+    as an object array with None for the rentals that lack the field,
+    columns of ints and floats as an object array keeping both types.
+    """
+    with np.load(filename) as npz:
+        schema = json.loads(str(npz[SCHEMA]))
+        if name not in schema:
+            raise KeyError(f"{filename} has no column {name!r}")
+        return decode_column(npz, schema[name], name)[0]
+
+
+def load_rentals_npz(filename):
+    """ this function loads a whole save_to_npz() file back into rentals """
+    with np.load(filename) as npz:
+        schema = json.loads(str(npz[SCHEMA]))
+        columns = {name: decode_column(npz, kind, name)
+                   for name, kind in schema.items()}
+    rentals = {key: {} for key in columns.pop(ID_COLUMN)[0].tolist()}
+    for name, (values, present) in columns.items():
+        if present is None:
+            present = itertools.repeat(True)
+        else:
+            present = present.tolist()
+        for rental, value, has in zip(rentals.values(), values.tolist(),
+                                      present):
+            if has:
+                rental[name] = value
+    return rentals
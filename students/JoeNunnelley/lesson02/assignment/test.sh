@@ -1,8 +1,10 @@
 #! /usr/bin/env bash
 
 echo 'Run Flake8'
-python3 -m flake8 charges_calc.py
+python3 -m flake8 charges_calc.py rental_columns.py
 echo 'Run Pylint'
-python3 -m pylint charges_calc.py
+python3 -m pylint charges_calc.py rental_columns.py
 
 
+echo 'Run Tests'
+python3 -m unittest test_charges_calc.py
@@ -0,0 +1,478 @@
+#! /usr/bin/env python3
+""" The charges_calc Test Suite """
+
+import datetime
+import io
+import json
+import marshal
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+import charges_calc
+import rental_columns
+
+
+def strptime_days(start, end):
+    """ The total_days calculation charges_calc used to do """
+    return (datetime.datetime.strptime(end, '%m/%d/%y') -
+            datetime.datetime.strptime(start, '%m/%d/%y')).days
+
+
+def temporary_directory(case):
+    """ A temporary directory removed when the test case finishes """
+    directory = tempfile.TemporaryDirectory()
+    case.addCleanup(directory.cleanup)
+    return directory.name
+
+
+class TestParseDate(TestCase):
+    """ Class for testing the cached rental date parser """
+    def test_matches_strptime(self):
+        """ Day counts agree with the strptime version """
+        dates = ['6/12/17', '3/22/17', '06/02/17', '2/29/16', '12/31/99',
+                 '1/1/00', '1/1/68', '1/1/69', '12/ 5/18']
+        for start in dates:
+            for end in dates:
+                self.assertEqual(charges_calc.parse_date(end) -
+                                 charges_calc.parse_date(start),
+                                 strptime_days(start, end))
+
+    def test_invalid_dates(self):
+        """ Bad dates raise ValueError just like strptime """
+        for text in ['2/29/17', '13/1/17', '0/1/17', '1/32/17', '1/1/2017',
+                     '1/1/17 ', '', 'tomorrow']:
+            with self.assertRaises(ValueError):
+                charges_calc.parse_date(text)
+
+    def test_cached(self):
+        """ Each distinct date string is only parsed once """
+        charges_calc.parse_date.cache_clear()
+        for _ in range(3):
+            charges_calc.parse_date('7/20/16')
+        info = charges_calc.parse_date.cache_info()
+        self.assertEqual((info.hits, info.misses), (2, 1))
+
+
+class TestCalculateAdditionalFields(TestCase):
+    """ Class for testing the derived rental fields """
+    def test_source_file(self):
+        """ The sample data still produces the saved output """
+        with open('source.json') as file:
+            data = json.load(file)
+        with open('output.json') as file:
+            expected = json.load(file)
+        self.assertEqual(charges_calc.calculate_additional_fields(data),
+                         expected)
+
+    def test_backward_dates(self):
+        """ Rentals ending before they start are dropped """
+        data = {'RNT001': {'product_code': 'PRD80',
+                           'units_rented': 8,
+                           'price_per_day': 31,
+                           'rental_start': '6/12/17',
+                           'rental_end': '3/22/17'},
+                'RNT002': {'product_code': 'PRD11',
+                           'units_rented': 1,
+                           'price_per_day': 16,
+                           'rental_start': '7/20/16',
+                           'rental_end': '9/30/18'}}
+        cleaned = charges_calc.calculate_additional_fields(data)
+        self.assertEqual(list(cleaned), ['RNT002'])
+        self.assertEqual(cleaned['RNT002']['total_days'],
+                         strptime_days('7/20/16', '9/30/18'))
+
+
+class TestStreaming(TestCase):
+    """ Class for testing the streaming json reader and writer """
+    def test_matches_json_load(self):
+        """ The stream yields what json.load returns, at any read size """
+        with open('source.json') as file:
+            text = file.read()
+        expected = list(json.loads(text).items())
+        for read_size in [1, 7, 4096]:
+            stream = charges_calc.RentalStream(io.StringIO(text), read_size)
+            self.assertEqual(list(stream), expected)
+
+    def test_odd_layout(self):
+        """ Compact, escaped and empty documents parse like json.loads """
+        for text in ['{}', ' { } ', '{"a\\"b":{"x":[1,2.5e3]},"c":12}\n',
+                     '{"RNT1" :{"units_rented" : 10}\r\n,\t"RNT2":null}']:
+            for read_size in [1, 3, 100]:
+                stream = charges_calc.RentalStream(io.StringIO(text),
+                                                   read_size)
+                self.assertEqual(list(stream), list(json.loads(text).items()))
+
+    def test_invalid(self):
+        """ Broken documents raise JSONDecodeError """
+        for text in ['', '[]', '{"a": 1', '{"a" 1}', '{"a": 1,}', '{1: 2}',
+                     '{"a": 1} x', '{"a": tru}']:
+            with self.assertRaises(json.JSONDecodeError):
+                list(charges_calc.RentalStream(io.StringIO(text), 2))
+
+    def test_save_matches_save_to_json(self):
+        """ Streamed output is byte for byte what save_to_json writes """
+        data = {'RNT1': {'product_code': 'PRD1', 'total_price': 2.5},
+                'RNT\u00e92': {'nested': {'a': [1, {}]}, 'empty': []},
+                'RNT3': {}}
+        directory = temporary_directory(self)
+        whole = os.path.join(directory, 'whole.json')
+        streamed = os.path.join(directory, 'streamed.json')
+        charges_calc.save_to_json(whole, data)
+        charges_calc.save_to_json_stream(streamed, iter(data.items()))
+        with open(whole) as expected, open(streamed) as actual:
+            self.assertEqual(actual.read(), expected.read())
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['streamed.json', 'whole.json'])
+
+    def test_source_file(self):
+        """ The streaming pipeline produces the saved output """
+        output = os.path.join(temporary_directory(self), 'output.json')
+        rentals = charges_calc.iter_rentals('source.json')
+        charges_calc.save_to_json_stream(
+            output, charges_calc.iter_additional_fields(rentals))
+        with open('output.json') as expected, open(output) as actual:
+            self.assertEqual(actual.read(), expected.read())
+
+
+class TestWorkers(TestCase):
+    """ Class for testing the process pool enrichment """
+    def test_matches_serial(self):
+        """ Workers produce the same rentals, log and key order """
+        with open('source.json') as file:
+            text = file.read()
+        with self.assertLogs(level='WARNING') as serial:
+            expected = charges_calc.calculate_additional_fields(
+                json.loads(text))
+        with self.assertLogs(level='WARNING') as parallel:
+            cleaned = dict(charges_calc.iter_additional_fields(
+                json.loads(text).items(), workers=2, chunk_size=37))
+        self.assertEqual(list(cleaned.items()), list(expected.items()))
+        self.assertEqual(parallel.output, serial.output)
+
+    def test_calculate_additional_fields(self):
+        """ calculate_additional_fields takes a worker count too """
+        with open('source.json') as file:
+            data = json.load(file)
+        with open('output.json') as file:
+            expected = json.load(file)
+        with self.assertLogs(level='ERROR'):
+            cleaned = charges_calc.calculate_additional_fields(data, 3)
+        self.assertEqual(list(cleaned.items()), list(expected.items()))
+
+
+class TestColumnar(TestCase):
+    """ Class for testing the numpy columnar mode """
+    def check_matches(self, text):
+        """ Columnar and per row modes agree on rentals, log and order """
+        with self.assertLogs(level='WARNING') as serial:
+            expected = charges_calc.calculate_additional_fields(
+                json.loads(text))
+        with self.assertLogs(level='WARNING') as columnar:
+            cleaned = charges_calc.calculate_additional_fields_numpy(
+                json.loads(text))
+        self.assertEqual(json.dumps(cleaned), json.dumps(expected))
+        self.assertEqual(columnar.output, serial.output)
+
+    def test_source_file(self):
+        """ The sample data gives the same results as the per row mode """
+        with open('source.json') as file:
+            self.check_matches(file.read())
+
+    def test_odd_rentals(self):
+        """ Rentals that don't fit the columns are checked one at a time """
+        rentals = {
+            'RNT1': {'product_code': 'PRD1', 'units_rented': 2,
+                     'price_per_day': 2.5, 'rental_start': '1/1/17',
+                     'rental_end': '1/9/17'},
+            'RNT2': {'product_code': 'PRD2', 'units_rented': 3,
+                     'price_per_day': 7, 'rental_start': '1/1/17',
+                     'rental_end': ''},
+            'RNT3': {'product_code': 'PRD3', 'units_rented': 0,
+                     'price_per_day': 7, 'rental_start': '1/1/17',
+                     'rental_end': '1/9/17'},
+            'RNT4': {'product_code': '', 'units_rented': 1,
+                     'price_per_day': 0, 'rental_start': '1/9/17',
+                     'rental_end': '1/1/17'},
+            'RNT5': {'product_code': 'PRD5', 'units_rented': 4,
+                     'price_per_day': 2 ** 40, 'rental_start': '1/1/17',
+                     'rental_end': '2/1/17'},
+            'RNT6': {'product_code': 'PRD6', 'units_rented': True,
+                     'price_per_day': 3, 'rental_start': '2/29/16',
+                     'rental_end': '3/1/16'},
+            'RNT7': {'product_code': 'PRD7', 'units_rented': 5,
+                     'price_per_day': -1, 'rental_start': '2/29/16',
+                     'rental_end': '3/1/16'},
+            'RNT8': {'product_code': 'PRD8', 'units_rented': 5,
+                     'price_per_day': 9, 'rental_start': '12/31/99',
+                     'rental_end': '1/1/00'}}
+        self.check_matches(json.dumps(rentals))
+        cleaned = charges_calc.calculate_additional_fields_numpy(rentals)
+        self.assertEqual(list(cleaned), ['RNT1', 'RNT5', 'RNT6', 'RNT8'])
+        self.assertIsInstance(cleaned['RNT8']['total_price'], int)
+
+    def test_empty(self):
+        """ No rentals in, none out """
+        self.assertEqual(charges_calc.calculate_additional_fields_numpy({}),
+                         {})
+
+
+class CountingRental(dict):
+    """ A rental that counts how often it is formatted for the log """
+    formatted = 0
+
+    def __repr__(self):
+        CountingRental.formatted += 1
+        return super().__repr__()
+
+
+class TestRentalLog(TestCase):
+    """ Class for testing the rental check logging """
+    def rentals(self):
+        """ The sample rentals """
+        with open('source.json') as file:
+            return json.load(file, object_hook=CountingRental)
+
+    def test_summary(self):
+        """ Rejections are reported once, tallied by reason """
+        with self.assertLogs(level='WARNING') as logs:
+            charges_calc.calculate_additional_fields(self.rentals())
+        self.assertEqual(logs.output, [
+            'ERROR:root:Rejected 497 of 999 rentals: '
+            'invalid rental dates (496), missing rental_end value (1), '
+            'unreadable rental dates (1)'])
+
+    def test_nothing_formatted(self):
+        """ Without debug logging no rental is ever formatted """
+        CountingRental.formatted = 0
+        for calculate in [charges_calc.calculate_additional_fields,
+                          charges_calc.calculate_additional_fields_numpy]:
+            with self.assertLogs(level='INFO'):
+                calculate(self.rentals())
+        self.assertEqual(CountingRental.formatted, 0)
+
+    def test_sampled_debug(self):
+        """ Debug describes one rental in every sample, in every mode """
+        outputs = []
+        for calculate in [charges_calc.calculate_additional_fields,
+                          charges_calc.calculate_additional_fields_numpy]:
+            with self.assertLogs(level='DEBUG') as logs:
+                calculate(self.rentals(), sample=100)
+            outputs.append(logs.output)
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertEqual(len(outputs[0]), 11)
+        self.assertTrue(outputs[0][0].startswith(
+            'DEBUG:root:Skipping item due to invalid rental dates:'))
+
+    def test_trace(self):
+        """ Trace writes a line for every rental checked """
+        with self.assertLogs(level=charges_calc.TRACE) as logs:
+            charges_calc.calculate_additional_fields(self.rentals(),
+                                                     sample=1000)
+        self.assertEqual(sum(line.startswith('TRACE:root:Checked rental')
+                             for line in logs.output), 999)
+
+
+class TestRentalCache(TestCase):
+    """ Class for testing the incremental recalculation cache """
+    def setUp(self):
+        self.cache_file = os.path.join(temporary_directory(self),
+                                       'rentals.cache')
+        with open('source.json') as file:
+            self.text = file.read()
+        with open('output.json') as file:
+            self.expected = json.load(file)
+
+    def run_cached(self, data):
+        """
+        One run through a fresh RentalCache, returns the cache, the
+        rentals kept and the log summary
+        """
+        cache = charges_calc.RentalCache(self.cache_file)
+        with self.assertLogs(level='ERROR') as logs:
+            cleaned = charges_calc.calculate_additional_fields(
+                data, cache=cache)
+        cache.save()
+        return cache, cleaned, logs.output
+
+    def test_hits(self):
+        """ A second run copies every rental from the cache """
+        cold, _, cold_summary = self.run_cached(json.loads(self.text))
+        self.assertEqual((cold.hits, cold.misses), (0, 999))
+        warm, cleaned, summary = self.run_cached(json.loads(self.text))
+        self.assertEqual((warm.hits, warm.misses), (999, 0))
+        self.assertEqual(warm.hit_ratio(), 1.0)
+        self.assertEqual(json.dumps(cleaned), json.dumps(self.expected))
+        self.assertEqual(summary, cold_summary)
+
+    def test_changed_rentals(self):
+        """ New and changed rentals are recomputed, removed ones dropped """
+        self.run_cached(json.loads(self.text))
+        data = json.loads(self.text)
+        data['RNT002']['price_per_day'] = 16.0
+        data['RNT004']['rental_end'] = '1/1/19'
+        del data['RNT005']
+        data['RNT1000'] = dict(data['RNT002'])
+        cache, cleaned, _ = self.run_cached(data)
+        self.assertEqual((cache.hits, cache.misses), (996, 3))
+        self.assertEqual(cleaned['RNT002']['total_price'],
+                         self.expected['RNT002']['total_price'])
+        self.assertIsInstance(cleaned['RNT002']['total_price'], float)
+        self.assertNotEqual(cleaned['RNT004']['total_days'],
+                            self.expected['RNT004']['total_days'])
+        with open(self.cache_file, 'rb') as file:
+            self.assertNotIn('RNT005', marshal.load(file)['rentals'])
+
+    def test_number_types(self):
+        """ A number written as an int instead of a float is a change """
+        data = json.loads(self.text)
+        data['RNT002']['price_per_day'] = 16.0
+        self.run_cached(data)
+        data = json.loads(self.text)
+        data['RNT002']['price_per_day'] = 16
+        cache, cleaned, _ = self.run_cached(data)
+        self.assertEqual(cache.misses, 1)
+        self.assertIsInstance(cleaned['RNT002']['total_price'], int)
+
+    def test_cached_output(self):
+        """ Output written from the cached records matches save_to_json """
+        output = os.path.join(os.path.dirname(self.cache_file), 'out.json')
+        for _ in range(2):
+            cache, cleaned, _ = self.run_cached(json.loads(self.text))
+            self.assertEqual(len(cache.records), len(cleaned))
+            charges_calc.save_to_json_stream(output, cleaned.items(),
+                                             cache.records)
+            with open('output.json') as expected, open(output) as actual:
+                self.assertEqual(actual.read(), expected.read())
+
+    def test_refused_with_stream(self):
+        """ The cache keeps every rental, so it can't be used to stream """
+        argv = ['charges_calc.py', '-i', 'source.json', '-o', 'out.json',
+                '-k', 'rentals.cache', '-s']
+        with patch('sys.argv', argv), \
+                patch('sys.stderr', new=io.StringIO()):
+            with self.assertRaises(SystemExit):
+                charges_calc.parse_cmd_arguments()
+
+    def test_unreadable_cache(self):
+        """ A broken cache file is ignored and rebuilt """
+        with open(self.cache_file, 'w') as file:
+            file.write('{not json')
+        with self.assertLogs(level='WARNING'):
+            cache = charges_calc.RentalCache(self.cache_file)
+        self.assertEqual(cache.entries, {})
+
+    def test_damaged_cache(self):
+        """ A cache without rentals or with odd entries is recomputed """
+        with open(self.cache_file, 'wb') as file:
+            marshal.dump({'version': charges_calc.CACHE_VERSION}, file)
+        with self.assertLogs(level='WARNING'):
+            cache = charges_calc.RentalCache(self.cache_file)
+        self.assertEqual(cache.entries, {})
+
+        self.run_cached(json.loads(self.text))
+        with open(self.cache_file, 'rb') as file:
+            rentals = marshal.load(file)['rentals']
+        inputs, fields, reasons, record = rentals['RNT002']
+        rentals['RNT002'] = (inputs, fields)
+        rentals['RNT003'] = (inputs, fields[:2], reasons, record)
+        rentals['RNT004'] = (inputs, fields, ('rejected',), record)
+        rentals['RNT005'] = (inputs, fields, reasons, 5)
+        rentals['RNT006'] = inputs
+        with open(self.cache_file, 'wb') as file:
+            marshal.dump({'version': charges_calc.CACHE_VERSION,
+                          'rentals': rentals}, file)
+        cache, cleaned, _ = self.run_cached(json.loads(self.text))
+        self.assertEqual(cache.misses, 5)
+        self.assertEqual(json.dumps(cleaned), json.dumps(self.expected))
+
+
+class TestNpzOutput(TestCase):
+    """ Class for testing the columnar .npz output """
+    def setUp(self):
+        self.filename = os.path.join(temporary_directory(self),
+                                     'output.npz')
+
+    def test_round_trip(self):
+        """ The saved output loads back unchanged """
+        with open('output.json') as file:
+            expected = json.load(file)
+        rental_columns.save_to_npz(self.filename, expected.items())
+        self.assertEqual(json.dumps(rental_columns.load_rentals_npz(
+            self.filename)), json.dumps(expected))
+
+    def test_column_types(self):
+        """ Numbers are stored natively and strings dictionary encoded """
+        with open('output.json') as file:
+            expected = json.load(file)
+        rental_columns.save_to_npz(self.filename, expected.items())
+        with np.load(self.filename) as npz:
+            arrays = dict(npz.items())
+        self.assertEqual(arrays['total_days'].dtype, np.int64)
+        self.assertEqual(arrays['unit_cost'].dtype, np.float64)
+        self.assertLess(len(arrays['product_code.values']), len(expected))
+        unit_cost = rental_columns.read_column(self.filename, 'unit_cost')
+        self.assertEqual(unit_cost.tolist(),
+                         [rental['unit_cost'] for rental in expected.values()])
+        self.assertEqual(
+            rental_columns.read_column(self.filename, 'rental_id').tolist(),
+            list(expected))
+        with self.assertRaises(KeyError):
+            rental_columns.read_column(self.filename, 'no_such_column')
+
+    def test_odd_fields(self):
+        """ Missing and mixed type fields survive the round trip """
+        rentals = {'RNT1': {'price_per_day': 2, 'note': 'late'},
+                   'RNT2': {'price_per_day': 2.5, 'tags': ['a', 'b']},
+                   'RNT3': {'price_per_day': 1, 'note': None,
+                            'tags': {'x': 1}, 'paid': True}}
+        rental_columns.save_to_npz(self.filename, rentals.items())
+        self.assertEqual(json.dumps(rental_columns.load_rentals_npz(
+            self.filename)), json.dumps(rentals))
+        self.assertEqual(
+            rental_columns.read_column(self.filename, 'note').tolist(),
+            ['late', None, None])
+        prices = rental_columns.read_column(self.filename, 'price_per_day')
+        self.assertEqual([type(price) for price in prices.tolist()],
+                         [int, float, int])
+
+    def test_mixed_numbers(self):
+        """ Ints next to floats in a column stay ints """
+        rentals = {'RNT1': {'p': 1}, 'RNT2': {'p': 2.5}, 'RNT3': {'p': 3.0},
+                   'RNT4': {'p': -2 ** 40}}
+        rental_columns.save_to_npz(self.filename, rentals.items())
+        self.assertEqual(json.dumps(rental_columns.load_rentals_npz(
+            self.filename)), json.dumps(rentals))
+
+    def test_trailing_nul(self):
+        """ Strings ending in NUL characters keep them """
+        rentals = {'RNT1\x00': {'note': 'x\x00', 'code': 'a'},
+                   'RNT2': {'note': 'y', 'code': 'b\x00\x00'}}
+        rental_columns.save_to_npz(self.filename, rentals.items())
+        self.assertEqual(rental_columns.load_rentals_npz(self.filename),
+                         rentals)
+        self.assertEqual(
+            rental_columns.read_column(self.filename, 'note').tolist(),
+            ['x\x00', 'y'])
+
+    def test_reserved_names(self):
+        """ Fields that would overwrite other arrays are refused """
+        for first, second in [({'__schema__': 1}, {'__schema__': 2}),
+                              ({'rental_id': 'x'}, {'rental_id': 'y'}),
+                              ({'x': 'a', 'x.codes': 1},
+                               {'x': 'b', 'x.codes': 2}),
+                              ({'x.values': 1, 'x': 'a'},
+                               {'x.values': 2, 'x': 'b'}),
+                              ({'x': 1, 'x.ints': 2},
+                               {'x': 1.5, 'x.ints': 3})]:
+            with self.assertRaises(ValueError):
+                rental_columns.save_to_npz(self.filename,
+                                           [('RNT1', first), ('RNT2', second)])
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_no_rentals(self):
+        """ Nothing is written without rentals """
+        with self.assertLogs(level='WARNING'):
+            rental_columns.save_to_npz(self.filename, iter([]))
+        self.assertFalse(os.path.exists(self.filename))
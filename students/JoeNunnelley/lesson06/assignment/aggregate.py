@@ -0,0 +1,227 @@
+#! /usr/bin/env python3
+
+"""
+declarative, single pass aggregation over the exercise csv file
+
+analyze() hard codes its report: a year histogram from column 5 and an
+'ao' count from column 6. Every new metric written the same way would be
+another full scan of the file. Here a report is described instead:
+
+    report = aggregate('data/exercise.csv', {
+        'year_count': Count(by=[Field(5, start=6)],
+                            where=[Greater(5, '00/00/2012')]),
+        'found': Count(where=[Contains(6, 'ao')]),
+        'total': Sum(1),
+    })
+
+All metrics are compiled into the source of one Python function with a
+single loop over the rows, so adding a metric adds a few lines to the loop
+body rather than another pass over the file. Group by keys give a dict
+keyed by the key (a tuple when there is more than one), metrics without
+keys give a plain number.
+"""
+from collections import OrderedDict
+import abc
+import csv
+import datetime
+
+
+class Field:
+    """ A column of the row, optionally sliced like row[index][start:stop] """
+    def __init__(self, index, start=None, stop=None):
+        self.index = int(index)
+        self.start = None if start is None else int(start)
+        self.stop = None if stop is None else int(stop)
+
+    def expression(self, _constants):
+        """ Python source for the value of this field """
+        if self.start is None and self.stop is None:
+            return f'row[{self.index}]'
+        start = '' if self.start is None else self.start
+        stop = '' if self.stop is None else self.stop
+        return f'row[{self.index}][{start}:{stop}]'
+
+
+class Filter:
+    """ Base class for row filters comparing a column with a value """
+    template = None
+
+    def __init__(self, field, value):
+        self.field = field if isinstance(field, Field) else Field(field)
+        self.value = value
+
+    def expression(self, constants):
+        """ Python source for the boolean test of this filter """
+        constants.append(self.value)
+        return self.template.format(field=self.field.expression(constants),
+                                    value=f'constants[{len(constants) - 1}]')
+
+
+class Greater(Filter):
+    """ Keep rows whose column compares greater than value """
+    template = '{field} > {value}'
+
+
+class Less(Filter):
+    """ Keep rows whose column compares less than value """
+    template = '{field} < {value}'
+
+
+class Equal(Filter):
+    """ Keep rows whose column equals value """
+    template = '{field} == {value}'
+
+
+class Contains(Filter):
+    """ Keep rows whose column contains the substring value """
+    template = '{value} in {field}'
+
+
+class OneOf(Filter):
+    """ Keep rows whose column is one of values """
+    template = '{field} in {value}'
+
+    def __init__(self, field, values):
+        super().__init__(field, frozenset(values))
+
+
+class Metric(abc.ABC):
+    """ Base class for the per group accumulators """
+    def __init__(self, by=(), where=(), keys=None):
+        self.by = [key if isinstance(key, Field) else Field(key)
+                   for key in by]
+        self.where = list(where)
+        self.keys = None if keys is None else list(keys)
+
+    @abc.abstractmethod
+    def increment(self, _constants):
+        """ Python source for the amount added to the group """
+
+    def key(self, constants):
+        """ Python source for the group key of a row """
+        keys = [key.expression(constants) for key in self.by]
+        if not keys:
+            return 'None'
+        if len(keys) == 1:
+            return keys[0]
+        return '(' + ', '.join(keys) + ',)'
+
+    def start(self):
+        """ The empty accumulator, seeded with any fixed keys """
+        return dict.fromkeys(self.keys or (), 0)
+
+    def finish(self, totals):
+        """ Turn an accumulator into the reported value """
+        if not self.by:
+            return totals.get(None, 0)
+        return totals
+
+
+class Count(Metric):
+    """ Count the rows in each group """
+    def increment(self, _constants):
+        return '1'
+
+
+class Sum(Metric):
+    """ Add up a numeric column in each group """
+    def __init__(self, field, by=(), where=(), keys=None, cast=float):
+        super().__init__(by, where, keys)
+        self.field = field if isinstance(field, Field) else Field(field)
+        self.cast = cast
+
+    def increment(self, constants):
+        constants.append(self.cast)
+        return (f'constants[{len(constants) - 1}]'
+                f'({self.field.expression(constants)})')
+
+
+def compile_metrics(metrics, where=()):
+    """
+    Compile metrics into a single pass function.
+
+    Returns (source, function). function(rows, totals) updates the list of
+    accumulators in totals (one per metric, in order) from every row.
+    """
+    constants = []
+    lines = ['def fused(rows, totals, constants):']
+    for number in range(len(metrics)):
+        lines.append(f'    totals_{number} = totals[{number}]')
+    lines.append('    for row in rows:')
+    indent = '        '
+    if where:
+        tests = ' and '.join(f'({test.expression(constants)})'
+                             for test in where)
+        lines.append(f'{indent}if not ({tests}):')
+        lines.append(f'{indent}    continue')
+
+    for number, metric in enumerate(metrics):
+        body = indent
+        if metric.where:
+            tests = ' and '.join(f'({test.expression(constants)})'
+                                 for test in metric.where)
+            lines.append(f'{indent}if {tests}:')
+            body += '    '
+        lines.append(f'{body}key = {metric.key(constants)}')
+        if metric.keys is not None:
+            lines.append(f'{body}if key in totals_{number}:')
+            body += '    '
+        lines.append(f'{body}totals_{number}[key] = '
+                     f'totals_{number}.get(key, 0) + '
+                     f'{metric.increment(constants)}')
+
+    source = '\n'.join(lines) + '\n'
+    namespace = {}
+    exec(compile(source, '<aggregate>', 'exec'),  # pylint: disable=exec-used
+         namespace)
+    function = namespace['fused']
+
+    def fused(rows, totals):
+        return function(rows, totals, constants)
+    return source, fused
+
+
+def aggregate_rows(rows, metrics, where=()):
+    """ Run named metrics over an iterable of rows in a single pass """
+    names = list(metrics)
+    specs = [metrics[name] for name in names]
+    _, fused = compile_metrics(specs, where)
+    totals = [metric.start() for metric in specs]
+    fused(rows, totals)
+    return {name: metric.finish(total)
+            for name, metric, total in zip(names, specs, totals)}
+
+
+def aggregate(filename, metrics, where=()):
+    """ Run named metrics over a csv file in a single pass """
+    with open(filename, newline='') as csvfile:
+        reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        return aggregate_rows(reader, metrics, where)
+
+
+def analyze(filename):
+    """ good_perf.analyze() expressed as an aggregation """
+    start = datetime.datetime.now()
+    report = aggregate(filename, {
+        'year_count': Count(by=[Field(5, start=6)],
+                            where=[Greater(5, '00/00/2012')]),
+        'found': Count(where=[Contains(6, 'ao')])})
+    year_count = report['year_count']
+    found = report['found']
+
+    print(dict(OrderedDict(sorted(year_count.items(),
+                                  key=lambda t: t[0]))))
+    print(f"'ao' was found {found} times")
+
+    end = datetime.datetime.now()
+    return (start, end, year_count, found)
+
+
+def main():
+    """ The main entry point function """
+    filename = "data/exercise.csv"
+    analyze(filename)
+
+
+if __name__ == "__main__":
+    main()
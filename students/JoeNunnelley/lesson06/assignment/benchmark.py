@@ -0,0 +1,265 @@
+#! /usr/bin/env python3
+
+"""
+Benchmark the analyze implementations against each other
+
+exercise.csv files of each requested size are generated (once, with a
+fixed seed) and every registered analyze implementation is run against
+them several times. The median and p95 wall clock time, rows per second
+and peak RSS of each implementation are reported as a table and,
+optionally, as JSON so runs can be compared over time.
+
+Each implementation runs in a freshly spawned process so its peak RSS is
+its own and not left over from whatever ran before it. The RSS of that
+process before its first run is recorded as the baseline.
+
+Register extra implementations with register(). Pass -w 2 4 8 to also time
+the multi process stream_perf at those worker counts.
+"""
+import argparse
+import builtins
+import contextlib
+import importlib
+import io
+import json
+import math
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import sys
+import time
+import generate_data
+import stream_perf
+
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+SEED = 6
+IMPLEMENTATIONS = {}
+
+
+def register(name, module, function='analyze', **kwargs):
+    """ Register module.function(filename, **kwargs) under name """
+    IMPLEMENTATIONS[name] = (module, function, kwargs)
+
+
+register('poor_perf', 'poor_perf')
+register('good_perf', 'good_perf')
+register('good_perf/numpy', 'good_perf', backend='numpy')
+register('good_perf/mmap', 'good_perf', 'analyze_mmap')
+register('stream_perf', 'stream_perf')
+register('aggregate', 'aggregate')
+
+
+def count_rows(filename):
+    """ Count the rows in the data file """
+    rows = 0
+    with open(filename, 'rb') as file:
+        for block in stream_perf.read_blocks(file):
+            rows += block.count(b'\n')
+            if not block.endswith(b'\n'):
+                rows += 1
+    return rows
+
+
+def data_file(directory, rows):
+    """ Return the data file with rows rows, generating it when missing """
+    filename = os.path.join(directory, f'exercise_{rows}.csv')
+    if not os.path.exists(filename):
+        os.makedirs(directory, exist_ok=True)
+        print(f"Generating {filename}")
+        generate_data.write_file_fast(filename, rows, seed=SEED)
+    return filename
+
+
+def load(module, function):
+    """ Import and return module.function """
+    # poor_perf is decorated for memory_profiler, which normally provides
+    # the profile builtin. Make it a no-op so the module can be imported.
+    if not hasattr(builtins, 'profile'):
+        builtins.profile = lambda func: func
+    return getattr(importlib.import_module(module), function)
+
+
+def max_rss():
+    """ Peak resident set size of this process in bytes """
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def time_runs(connection, job):
+    """
+    Run one (module, function, kwargs, filename, repeat) job.
+
+    Sends the wall clock timings of each run, the peak RSS in bytes of the
+    process that ran them and its RSS before the first run back through
+    connection.
+    """
+    module, function, kwargs, filename, repeat = job
+    analyze = load(module, function)
+    baseline = max_rss()
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            analyze(filename, **kwargs)
+            timings.append(time.perf_counter() - start)
+    connection.send((timings, max_rss(), baseline))
+    connection.close()
+
+
+def spawn_job(job):
+    """ Run time_runs() for job in a fresh interpreter and return results """
+    context = mp.get_context('spawn')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=time_runs, args=(sender, job))
+    process.start()
+    sender.close()
+    try:
+        return receiver.recv()
+    except EOFError:
+        raise RuntimeError(f"benchmark job {job[:2]} failed") from None
+    finally:
+        process.join()
+
+
+def percentile(values, percent):
+    """ Nearest rank percentile of a list of values """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def summarize(name, rows, timings, peak_rss, baseline_rss):
+    """ Turn the raw timings of one job into a result record """
+    median = statistics.median(timings)
+    return {'implementation': name,
+            'rows': rows,
+            'runs': len(timings),
+            'median': median,
+            'p95': percentile(timings, 95),
+            'min': min(timings),
+            'rows_per_sec': rows / median,
+            'peak_rss_mib': peak_rss / 2 ** 20,
+            'baseline_rss_mib': baseline_rss / 2 ** 20}
+
+
+def print_table(results, header=True):
+    """ Print the result records as a table """
+    if header:
+        print(f"{'implementation':<16} {'rows':>10} {'median s':>9} "
+              f"{'p95 s':>9} {'rows/sec':>12} {'peak MiB':>9}")
+    for result in results:
+        print(f"{result['implementation']:<16} {result['rows']:>10,} "
+              f"{result['median']:>9.3f} {result['p95']:>9.3f} "
+              f"{result['rows_per_sec']:>12,.0f} "
+              f"{result['peak_rss_mib']:>9.1f}")
+
+
+def run(files, repeat=5, implementations=None):
+    """ Benchmark the implementations against each file and return results """
+    implementations = implementations or IMPLEMENTATIONS
+    results = []
+    for filename in files:
+        rows = count_rows(filename)
+        for name, (module, function, kwargs) in implementations.items():
+            measured = spawn_job((module, function, kwargs, filename, repeat))
+            results.append(summarize(name, rows, *measured))
+            print_table(results[-1:], header=len(results) == 1)
+    return results
+
+
+def regressions(results, previous, tolerance=0.1):
+    """
+    Compare results against an earlier run.
+
+    Returns (implementation, rows, old median, new median) for every
+    implementation and size whose median got slower by more than tolerance.
+    """
+    old = {(result['implementation'], result['rows']): result['median']
+           for result in previous}
+    slower = []
+    for result in results:
+        key = (result['implementation'], result['rows'])
+        if key in old and result['median'] > old[key] * (1 + tolerance):
+            slower.append(key + (old[key], result['median']))
+    return slower
+
+
+def parse_cmd_arguments():
+    """ this function parses the command line arguments """
+    parser = argparse.ArgumentParser(description='Benchmark analyze().')
+    parser.add_argument('-f',
+                        '--file',
+                        help='benchmark this csv file instead of generated '
+                             'ones')
+    parser.add_argument('-n',
+                        '--sizes',
+                        help='row counts of the generated files',
+                        type=int,
+                        nargs='+',
+                        default=SIZES)
+    parser.add_argument('-d',
+                        '--data-dir',
+                        help='directory for the generated files',
+                        default='data/benchmark')
+    parser.add_argument('-r',
+                        '--repeat',
+                        help='number of runs per implementation',
+                        type=int,
+                        default=5)
+    parser.add_argument('-i',
+                        '--implementations',
+                        help='only run these registered implementations',
+                        nargs='+',
+                        choices=sorted(IMPLEMENTATIONS))
+    parser.add_argument('-w',
+                        '--workers',
+                        help='also run stream_perf with these worker counts',
+                        type=int,
+                        nargs='*',
+                        default=[])
+    parser.add_argument('-j',
+                        '--json',
+                        help='also write the results to this JSON file')
+    parser.add_argument('-c',
+                        '--compare',
+                        help='JSON results of an earlier run to check for '
+                             'regressions against')
+    parser.add_argument('-t',
+                        '--tolerance',
+                        help='allowed slow down before a median counts as a '
+                             'regression (default 0.1 = 10%%)',
+                        type=float,
+                        default=0.1)
+    return parser.parse_args()
+
+
+def main():
+    """ The main entry point function """
+    args = parse_cmd_arguments()
+    selected = {name: IMPLEMENTATIONS[name]
+                for name in args.implementations or IMPLEMENTATIONS}
+    for workers in args.workers:
+        selected[f'stream_perf/{workers}'] = ('stream_perf', 'analyze',
+                                              {'workers': workers})
+    files = [args.file] if args.file else [data_file(args.data_dir, rows)
+                                           for rows in args.sizes]
+
+    results = run(files, args.repeat, selected)
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as json_file:
+            slower = regressions(results, json.load(json_file),
+                                 args.tolerance)
+        for name, rows, old, new in slower:
+            print(f"REGRESSION {name} at {rows:,} rows: median {old:.3f}s "
+                  f"-> {new:.3f}s")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
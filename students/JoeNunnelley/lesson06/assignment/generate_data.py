@@ -1,11 +1,30 @@
 #! /usr/bin/env python3
-""" Generate data for our profiling """
+"""
+Generate data for our profiling
+
+write_file() builds and writes one row at a time. write_file_fast() builds
+whole blocks of rows with numpy and writes each block in a single call,
+and write_file_sharded() spreads that work over several processes.
+"""
+import argparse
 import csv
 import datetime
+import multiprocessing as mp
+import os
 import random
+import shutil
 import uuid
 import numpy as np
 
+BLOCK_ROWS = 100_000
+WRITE_BUFFER = 16 * 1024 * 1024
+START_DATE = datetime.date(2012, 1, 1)
+DAY_RANGE = 366 * 10
+NUMBERS = np.array([str(number).encode() for number in range(1001)])
+DATES = np.array([(START_DATE + datetime.timedelta(day))
+                  .strftime("%m/%d/%Y").encode() for day in range(DAY_RANGE)])
+AO_VALUES = np.array([b'', b'ao'])
+
 
 def get_rand_row():
     """ Generate a random row for the file """
@@ -36,5 +55,113 @@ def write_file(filename, rowcount=100):
             writer.writerow(get_rand_row())
 
 
+def make_ids(rng, rows):
+    """ Random (version 4) uuids for a block of rows as an S36 array """
+    raw = rng.integers(0, 256, size=(rows, 16), dtype=np.uint8)
+    raw[:, 6] = (raw[:, 6] & 0x0f) | 0x40
+    raw[:, 8] = (raw[:, 8] & 0x3f) | 0x80
+    digits = np.frombuffer(raw.tobytes().hex().encode(),
+                           dtype='S1').reshape(rows, 32)
+    dash = np.full((rows, 1), b'-', dtype='S1')
+    return np.concatenate([digits[:, :8], dash, digits[:, 8:12], dash,
+                           digits[:, 12:16], dash, digits[:, 16:20], dash,
+                           digits[:, 20:]], axis=1).view('S36').ravel()
+
+
+def make_block(rng, rows):
+    """
+    Build a block of rows in the same layout get_rand_row() produces.
+
+    Every column is generated as a whole array and the numbers, dates and
+    'ao' flags are looked up from precomputed byte strings, so no Python
+    code runs per row.
+    """
+    columns = [make_ids(rng, rows)]
+    columns.extend(NUMBERS[rng.integers(1, 1001, size=(4, rows))])
+    columns.append(DATES[rng.integers(1, DAY_RANGE, size=rows)])
+    columns.append(AO_VALUES[rng.integers(0, 2, size=rows)])
+
+    lines = columns[0]
+    for column in columns[1:]:
+        lines = np.char.add(np.char.add(lines, b','), column)
+    return b'\r\n'.join(lines.tolist()) + b'\r\n'
+
+
+def write_rows(data_file, rowcount, rng, block_rows=BLOCK_ROWS):
+    """ Write rowcount rows to an open binary file one block at a time """
+    for first in range(0, rowcount, block_rows):
+        data_file.write(make_block(rng, min(block_rows, rowcount - first)))
+
+
+def write_file_fast(filename, rowcount=100, block_rows=BLOCK_ROWS,
+                    seed=None):
+    """ Write the rows to the file in numpy generated blocks """
+    rng = np.random.default_rng(seed)
+    with open(filename, 'wb', buffering=WRITE_BUFFER) as data_file:
+        write_rows(data_file, rowcount, rng, block_rows)
+
+
+def write_part(job):
+    """ Write one (filename, rowcount, block_rows, seed) part file """
+    filename, rowcount, block_rows, seed = job
+    with open(filename, 'wb', buffering=WRITE_BUFFER) as data_file:
+        write_rows(data_file, rowcount, np.random.default_rng(seed),
+                   block_rows)
+    return filename
+
+
+def write_file_sharded(filename, rowcount=100, workers=None,
+                       block_rows=BLOCK_ROWS, seed=None):
+    """
+    Write the rows using a pool of processes.
+
+    Each worker writes its share of the rows to a part file with its own
+    random stream and the parts are concatenated into filename in order.
+    """
+    workers = workers or os.cpu_count()
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    jobs = [(f'{filename}.part{part:03d}',
+             rowcount // workers + (part < rowcount % workers),
+             block_rows, seeds[part]) for part in range(workers)]
+
+    with mp.Pool(workers) as pool:
+        parts = pool.map(write_part, jobs)
+
+    with open(filename, 'wb') as data_file:
+        for part in parts:
+            with open(part, 'rb') as part_file:
+                shutil.copyfileobj(part_file, data_file, WRITE_BUFFER)
+            os.remove(part)
+
+
+def parse_cmd_arguments():
+    """ this function parses the command line arguments """
+    parser = argparse.ArgumentParser(description='Generate exercise data.')
+    parser.add_argument('-o',
+                        '--output',
+                        help='csv file to write',
+                        default='data/exercise.csv')
+    parser.add_argument('-n',
+                        '--rows',
+                        help='number of rows to write',
+                        type=int,
+                        default=1_000_000)
+    parser.add_argument('-w',
+                        '--workers',
+                        help='write part files in this many processes',
+                        type=int,
+                        default=1)
+    parser.add_argument('-s',
+                        '--seed',
+                        help='seed for the random generator',
+                        type=int)
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    print(write_file('data/exercise.csv', 1_000_000))
+    ARGS = parse_cmd_arguments()
+    if ARGS.workers > 1:
+        write_file_sharded(ARGS.output, ARGS.rows, ARGS.workers,
+                           seed=ARGS.seed)
+    else:
+        write_file_fast(ARGS.output, ARGS.rows, seed=ARGS.seed)
@@ -0,0 +1,161 @@
+#! /usr/bin/env python3
+
+"""
+incremental analysis of an append only exercise csv file
+
+A sidecar index (<filename>.idx by default) remembers how far into the
+file the last run got along with the year_count and found totals up to
+that point. The next run only scans the bytes appended since then, so the
+report costs O(new rows) instead of O(file).
+
+The index is thrown away and rebuilt from scratch when the file no longer
+looks like the one it describes: it got shorter, the checksum of its first
+block or of the block just before the stored offset changed, or it was
+touched without growing.
+"""
+from collections import OrderedDict
+import datetime
+import hashlib
+import json
+import logging
+import os
+import stream_perf
+
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+CHECKSUM_SIZE = 64 * 1024
+
+
+def index_name(filename):
+    """ The default sidecar index file name for a data file """
+    return filename + '.idx'
+
+
+def checksum(file, start, end):
+    """ sha1 hex digest of the bytes in [start, end) of a binary file """
+    file.seek(start)
+    return hashlib.sha1(file.read(end - start)).hexdigest()
+
+
+def fingerprint(file, offset):
+    """ Checksums of the head and of the last block before offset """
+    return {'head': checksum(file, 0, min(CHECKSUM_SIZE, offset)),
+            'edge': checksum(file, max(0, offset - CHECKSUM_SIZE), offset)}
+
+
+def complete_end(file, start, size):
+    """ Offset just past the last line break in [start, size) """
+    position = size
+    while position > start:
+        block_start = max(start, position - stream_perf.BLOCK_SIZE)
+        file.seek(block_start)
+        block = file.read(position - block_start)
+        cut = block.rfind(b'\n')
+        if cut != -1:
+            return block_start + cut + 1
+        position = block_start
+    return start
+
+
+def load_index(index_file):
+    """ Read an index file, returning None when it is missing or unusable """
+    try:
+        with open(index_file) as file:
+            index = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        LOGGER.warning("Ignoring unreadable index %s: %s", index_file, error)
+        return None
+
+    if not isinstance(index, dict):
+        LOGGER.warning("Ignoring unusable index %s", index_file)
+        return None
+    if index.get('version') != INDEX_VERSION:
+        LOGGER.info("Ignoring index %s from another version", index_file)
+        return None
+    return index
+
+
+def save_index(index_file, index):
+    """ Write the index next to the data file, replacing it atomically """
+    temp_file = index_file + '.tmp'
+    with open(temp_file, 'w') as file:
+        json.dump(index, file)
+    os.replace(temp_file, index_file)
+
+
+def still_valid(index, file, stat):
+    """ Check that the data file is an append only extension of the index """
+    offset = index['offset']
+    if stat.st_size < offset:
+        LOGGER.info("Data file shrank from %d to %d bytes, rebuilding",
+                    offset, stat.st_size)
+        return False
+    if stat.st_size == index['size'] and stat.st_mtime != index['mtime']:
+        LOGGER.info("Data file was modified without growing, rebuilding")
+        return False
+    if fingerprint(file, offset) != index['checksums']:
+        LOGGER.info("Data file was rewritten, rebuilding")
+        return False
+    return True
+
+
+def update(filename, index_file=None):
+    """
+    Bring the index for filename up to date and return it.
+
+    Only the complete lines appended since the last update are scanned. A
+    trailing line that is still being written is left for the next run.
+    """
+    index_file = index_file or index_name(filename)
+    index = load_index(index_file)
+    with open(filename, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        if index is None or not still_valid(index, file, stat):
+            index = {'version': INDEX_VERSION, 'offset': 0,
+                     'year_count': {}, 'found': 0}
+
+        start = index['offset']
+        end = complete_end(file, start, stat.st_size)
+        LOGGER.debug("Scanning %s bytes %d to %d", filename, start, end)
+        dates, flags = stream_perf.scan_range((filename, start, end,
+                                               stream_perf.BLOCK_SIZE))
+        year_count, found = stream_perf.summarize(dates, flags)
+
+        totals = index['year_count']
+        for year, count in year_count.items():
+            totals[year] = totals.get(year, 0) + count
+        index['found'] += found
+        index.update(offset=end, size=stat.st_size, mtime=stat.st_mtime,
+                     checksums=fingerprint(file, end))
+
+    save_index(index_file, index)
+    return index
+
+
+def analyze(filename, index_file=None):
+    """ This function analyzes a data file, scanning only new rows """
+    start = datetime.datetime.now()
+    index = update(filename, index_file)
+    year_count = index['year_count']
+    found = index['found']
+
+    print(dict(OrderedDict(sorted(year_count.items(),
+                                  key=lambda t: t[0]))))
+    print(f"'ao' was found {found} times")
+
+    end = datetime.datetime.now()
+    return (start, end, year_count, found)
+
+
+def main():
+    """ The main entry point function """
+    filename = "data/exercise.csv"
+    analyze(filename)
+
+
+if __name__ == "__main__":
+    main()
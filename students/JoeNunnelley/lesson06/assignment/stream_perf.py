@@ -0,0 +1,194 @@
+#! /usr/bin/env python3
+
+"""
+streaming, single pass version of the good_perf analysis
+
+The file is read once in large binary blocks instead of being handed to
+csv.reader a row at a time. Each block is cut at its last line break so
+only one partial line is ever carried over to the next block, which keeps
+memory use bounded by the block size no matter how large the file is.
+Each block is split into fields in one go and the date and 'ao' flag
+columns are sliced out and tallied by distinct value, so there is no
+Python level loop per row. Blocks containing quote characters fall back to
+the csv module so quoted fields are still handled correctly.
+"""
+from collections import Counter, OrderedDict
+import csv
+import datetime
+import io
+import multiprocessing as mp
+import os
+
+BLOCK_SIZE = 64 * 1024
+CUTOFF = b'00/00/2012'
+DATE_FIELD = 5
+AO_FIELD = 6
+
+
+def read_blocks(file, block_size=BLOCK_SIZE, length=None):
+    """
+    Yield chunks of complete lines from a binary file.
+
+    When length is given no more than length bytes are read from the
+    current position. A trailing line without a line break is returned as
+    the final chunk.
+    """
+    remainder = b''
+    while length is None or length > 0:
+        if length is not None:
+            block_size = min(block_size, length)
+        block = file.read(block_size)
+        if not block:
+            break
+        if length is not None:
+            length -= len(block)
+        cut = block.rfind(b'\n') + 1
+        if cut == 0:
+            remainder += block
+            continue
+        yield remainder + block[:cut]
+        remainder = block[cut:]
+
+    if remainder:
+        yield remainder
+
+
+def scan_block(block, dates, flags):
+    """
+    Tally the date and 'ao' flag columns of a chunk of complete lines.
+
+    dates and flags are Counters keyed by the raw bytes of each column.
+    Only distinct values are kept so they stay small however many rows
+    are scanned, and summarize() turns them into the analyze results.
+    """
+    if b'"' in block:
+        _scan_quoted_block(block, dates, flags)
+        return
+
+    if block.count(b'\r') == block.count(b'\r\n'):
+        block = block.translate(None, b'\r')
+    block = block.rstrip(b'\n')
+    if not block:
+        return
+
+    # With a fixed number of fields per line the whole chunk can be split
+    # at once and the columns sliced out without a Python loop per row.
+    width = AO_FIELD + 1
+    lines = block.count(b'\n') + 1
+    fields = block.replace(b'\n', b',').split(b',')
+    if b'\n\n' not in block and len(fields) == width * lines:
+        dates.update(fields[DATE_FIELD::width])
+        flags.update(fields[AO_FIELD::width])
+        return
+
+    for line in block.splitlines():
+        if not line:
+            continue
+        fields = line.split(b',', width)
+        dates[fields[DATE_FIELD]] += 1
+        flags[fields[AO_FIELD]] += 1
+
+
+def _scan_quoted_block(block, dates, flags):
+    """ Slow path for chunks that need a real csv parse """
+    text = io.StringIO(block.decode(), newline='')
+    for row in csv.reader(text, delimiter=',', quotechar='"'):
+        if not row:
+            continue
+        dates[row[DATE_FIELD].encode()] += 1
+        flags[row[AO_FIELD].encode()] += 1
+
+
+def summarize(dates, flags):
+    """ Reduce the date and flag tallies to (year_count, found) """
+    year_count = {}
+    for date, count in dates.items():
+        if date > CUTOFF:
+            year = date[6:].decode()
+            year_count[year] = year_count.get(year, 0) + count
+    found = sum(count for flag, count in flags.items() if b'ao' in flag)
+    return year_count, found
+
+
+def split_ranges(filename, parts):
+    """
+    Split a file into at most parts (start, end) byte ranges.
+
+    Every range starts at the beginning of a line so the ranges can be
+    scanned independently and their tallies simply added together.
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+    with open(filename, 'rb') as file:
+        for part in range(1, parts):
+            offset = size * part // parts
+            if offset <= bounds[-1]:
+                continue
+            # Back up one byte so an offset that already sits at the start
+            # of a line is kept rather than skipped to the next one.
+            file.seek(offset - 1)
+            file.readline()
+            position = file.tell()
+            if position >= size:
+                break
+            bounds.append(position)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+
+def scan_range(job):
+    """
+    Tally the (filename, start, end, block_size) byte range of a file.
+
+    Returns the partial (dates, flags) Counters. This is the unit of work
+    handed to each process in the pool.
+    """
+    filename, start, end, block_size = job
+    dates = Counter()
+    flags = Counter()
+    with open(filename, 'rb') as csvfile:
+        csvfile.seek(start)
+        length = None if end is None else end - start
+        for block in read_blocks(csvfile, block_size, length):
+            scan_block(block, dates, flags)
+    return dates, flags
+
+
+def analyze(filename, block_size=BLOCK_SIZE, workers=1):
+    """
+    This function analyzes a data file in a single streaming pass
+
+    With workers > 1 the file is split into line aligned byte ranges that
+    are scanned by a process pool and the partial tallies are merged here.
+    """
+    start = datetime.datetime.now()
+    if workers > 1:
+        dates = Counter()
+        flags = Counter()
+        jobs = [(filename, range_start, range_end, block_size)
+                for range_start, range_end in split_ranges(filename, workers)]
+        with mp.Pool(workers) as pool:
+            for part_dates, part_flags in pool.imap_unordered(scan_range,
+                                                              jobs):
+                dates.update(part_dates)
+                flags.update(part_flags)
+    else:
+        dates, flags = scan_range((filename, 0, None, block_size))
+
+    year_count, found = summarize(dates, flags)
+    print(dict(OrderedDict(sorted(year_count.items(),
+                                  key=lambda t: t[0]))))
+    print(f"'ao' was found {found} times")
+
+    end = datetime.datetime.now()
+    return (start, end, year_count, found)
+
+
+def main():
+    """ The main entry point function """
+    filename = "data/exercise.csv"
+    analyze(filename)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,20 @@
 #! /usr/bin/env bash
 
-FILE='good_perf.py'
+FILES=("generate_data.py" "good_perf.py" "stream_perf.py" "incremental_perf.py"
+       "aggregate.py" "benchmark.py")
 
-echo "PYLINT EXAMINATION [$FILE]"
 export PYTHONPATH=$PYTHONPATH:"${PWD}"
-python3 -m pylint $FILE --rcfile=pylintrc
-echo "FLAKE8 EXAMINATION OF [$FILE]"
-python3 -m flake8 $FILE
-echo "RUN CODE [$FILE]"
-python3 $FILE
+
+for FILE in "${FILES[@]}"
+do
+  echo "PYLINT EXAMINATION [$FILE]"
+  python3 -m pylint $FILE --rcfile=pylintrc
+  echo "FLAKE8 EXAMINATION OF [$FILE]"
+  python3 -m flake8 $FILE
+done
+
+echo "RUN TESTS"
+python3 -m unittest test_perf.py
+echo "RUN CODE [good_perf.py]"
+python3 good_perf.py
 echo 'DONE'
@@ -0,0 +1,368 @@
+#! /usr/bin/env python3
+""" The lesson06 analyze() Test Suite """
+
+import contextlib
+import csv
+import datetime
+import io
+import os
+import tempfile
+import uuid
+from unittest import TestCase
+from unittest.mock import patch
+import numpy as np
+import aggregate
+import benchmark
+import generate_data
+import good_perf
+import incremental_perf
+import stream_perf
+
+
+ROWS = ['5df44a54-8cca-4928-bc53-caabb23cf329,1,2,3,4,05/26/2015,',
+        'bc337622-119c-445d-9282-e4b980201c03,2,3,4,5,08/02/2011,ao',
+        'f7a66f58-cfb2-459b-aca7-7eebd6f5417d,3,4,5,6,04/26/2017,',
+        'a1b2c3d4-0000-0000-0000-000000000000,4,5,6,7,12/31/2018,xaoy',
+        'a1b2c3d4-0000-0000-0000-000000000001,5,6,7,8,"01/01/2016",ao',
+        'a1b2c3d4-0000-0000-0000-000000000002,6,7,8,9,00/00/2010,ao']
+
+
+def write_rows(rows, repeat=1, newline='\r\n'):
+    """ Write rows to a temporary csv file and return its name """
+    handle, filename = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(handle, 'w', newline='') as file:
+        for _ in range(repeat):
+            for row in rows:
+                file.write(row + newline)
+    return filename
+
+
+def quiet(analyze, *args, **kwargs):
+    """ Run an analyze function with its printing suppressed """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return analyze(*args, **kwargs)
+
+
+class TestGoodPerfBackends(TestCase):
+    """ Class for testing the good_perf backends """
+    def setUp(self):
+        self.filename = write_rows(ROWS, repeat=20)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_numpy_matches_python(self):
+        """ The numpy backend returns the same counts as the python one """
+        self.assertEqual(
+            quiet(good_perf.analyze, self.filename, backend='numpy')[2:],
+            quiet(good_perf.analyze, self.filename, backend='python')[2:])
+
+    def test_unknown_backend(self):
+        """ An unknown backend name is rejected """
+        with self.assertRaises(ValueError):
+            good_perf.analyze(self.filename, backend='fortran')
+
+
+class TestAnalyzeMmap(TestCase):
+    """ Class for testing the memory mapped analyze """
+    def check(self, filename, **kwargs):
+        """ analyze_mmap agrees with the csv.reader loop """
+        self.addCleanup(os.remove, filename)
+        self.assertEqual(quiet(good_perf.analyze_mmap, filename, **kwargs)[2:],
+                         quiet(good_perf.analyze, filename)[2:])
+
+    def test_fixed_layout(self):
+        """ Unquoted files are counted on the vectorized path """
+        rows = [row for row in ROWS if '"' not in row]
+        rows.append('ao-is-not-the-flag,1,2,3,4,01/02/2014,xa')
+        filename = write_rows(rows, repeat=30)
+        with open(filename, 'rb') as file:
+            buf = np.frombuffer(file.read(), dtype=np.uint8)
+        self.assertIsNotNone(good_perf.count_window(buf))
+        self.check(filename)
+        self.check(write_rows(rows, repeat=30, newline='\n'), window=100)
+
+    def test_quoted_rows(self):
+        """ Windows with quotes fall back to the csv module """
+        self.check(write_rows(ROWS, repeat=30), window=300)
+
+    def test_ragged_rows(self):
+        """ Windows with ragged rows fall back to a per line split """
+        self.check(write_rows(ROWS[:4] + [ROWS[0] + ',extra,aoao'], repeat=5),
+                   window=64)
+
+    def test_no_trailing_newline(self):
+        """ A last line without a line break is still counted """
+        filename = write_rows(ROWS[:3])
+        with open(filename, 'a') as file:
+            file.write(ROWS[3])
+        self.check(filename, window=16)
+
+    def test_empty_file(self):
+        """ An empty file has nothing to count """
+        filename = write_rows([])
+        self.addCleanup(os.remove, filename)
+        self.assertEqual(quiet(good_perf.analyze_mmap, filename)[2:], ({}, 0))
+
+
+class TestStreamPerf(TestCase):
+    """ Class for testing the streaming analyze """
+    def setUp(self):
+        self.filename = write_rows(ROWS, repeat=50)
+        self.addCleanup(os.remove, self.filename)
+        self.expected = quiet(good_perf.analyze, self.filename)[2:]
+
+    def test_matches_good_perf(self):
+        """ The streaming engine returns the same counts as good_perf """
+        self.assertEqual(quiet(stream_perf.analyze, self.filename)[2:],
+                         self.expected)
+
+    def test_small_blocks(self):
+        """ Lines that straddle block boundaries are still counted once """
+        for block_size in (1, 7, 64, 1000):
+            result = quiet(stream_perf.analyze, self.filename,
+                           block_size=block_size)
+            self.assertEqual(result[2:], self.expected)
+
+    def test_no_trailing_newline(self):
+        """ A last line without a line break is still counted """
+        filename = write_rows(ROWS[:3], newline='\n')
+        self.addCleanup(os.remove, filename)
+        with open(filename, 'a') as file:
+            file.write(ROWS[3])
+        result = quiet(stream_perf.analyze, filename, block_size=16)
+        self.assertEqual(result[2:], ({'2015': 1, '2011': 1, '2017': 1,
+                                       '2018': 1}, 2))
+
+    def test_ragged_rows(self):
+        """ Rows with extra fields fall back to the per line split """
+        filename = write_rows(ROWS[:4] + [ROWS[0] + ',extra,ao'], repeat=3)
+        self.addCleanup(os.remove, filename)
+        self.assertEqual(quiet(stream_perf.analyze, filename)[2:],
+                         quiet(good_perf.analyze, filename)[2:])
+
+
+class TestParallelStreamPerf(TestCase):
+    """ Class for testing the multi process streaming analyze """
+    def setUp(self):
+        self.filename = write_rows(ROWS, repeat=200)
+        self.addCleanup(os.remove, self.filename)
+        self.expected = quiet(good_perf.analyze, self.filename)[2:]
+
+    def test_ranges_cover_file(self):
+        """ The byte ranges are contiguous and start on a line """
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as file:
+            data = file.read()
+        for parts in (1, 2, 3, 7, 5000):
+            ranges = stream_perf.split_ranges(self.filename, parts)
+            self.assertLessEqual(len(ranges), parts)
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], size)
+            for (_, end), (start, _) in zip(ranges, ranges[1:]):
+                self.assertEqual(end, start)
+                self.assertEqual(data[start - 1:start], b'\n')
+
+    def test_matches_serial(self):
+        """ Merged partial results match the serial scan exactly """
+        for workers in (2, 3):
+            result = quiet(stream_perf.analyze, self.filename,
+                           block_size=100, workers=workers)
+            self.assertEqual(result[2:], self.expected)
+
+
+class TestIncrementalPerf(TestCase):
+    """ Class for testing the incremental, indexed analyze """
+    def setUp(self):
+        self.filename = write_rows(ROWS[:4], repeat=10)
+        self.index_file = incremental_perf.index_name(self.filename)
+        self.addCleanup(os.remove, self.filename)
+        self.addCleanup(lambda: os.path.exists(self.index_file) and
+                        os.remove(self.index_file))
+
+    def assert_matches_full_scan(self):
+        """ The indexed result equals a full good_perf scan """
+        self.assertEqual(quiet(incremental_perf.analyze, self.filename)[2:],
+                         quiet(good_perf.analyze, self.filename)[2:])
+
+    def append(self, text):
+        """ Append raw text to the data file """
+        with open(self.filename, 'a', newline='') as file:
+            file.write(text)
+
+    def test_appended_rows_only(self):
+        """ Only the appended tail is scanned on later runs """
+        self.assert_matches_full_scan()
+        offset = incremental_perf.load_index(self.index_file)['offset']
+        self.assertEqual(offset, os.path.getsize(self.filename))
+
+        self.append(ROWS[1] + '\r\n' + ROWS[3] + '\r\n')
+        with patch('stream_perf.scan_range',
+                   wraps=stream_perf.scan_range) as scan_range:
+            self.assert_matches_full_scan()
+        self.assertEqual(scan_range.call_args[0][0][1], offset)
+
+    def test_partial_line_waits(self):
+        """ A line still being written is left for the next run """
+        quiet(incremental_perf.analyze, self.filename)
+        self.append(ROWS[1][:20])
+        result = quiet(incremental_perf.analyze, self.filename)
+        self.append(ROWS[1][20:] + '\r\n')
+        self.assertEqual(result[3] + 1,
+                         quiet(incremental_perf.analyze, self.filename)[3])
+        self.assert_matches_full_scan()
+
+    def test_truncated_file_rebuilds(self):
+        """ A file that shrank is rescanned from the start """
+        quiet(incremental_perf.analyze, self.filename)
+        with open(self.filename, 'w', newline='') as file:
+            file.write(ROWS[0] + '\r\n')
+        self.assert_matches_full_scan()
+
+    def test_rewritten_file_rebuilds(self):
+        """ A rewritten head is detected even when the file grew """
+        quiet(incremental_perf.analyze, self.filename)
+        with open(self.filename, 'r+', newline='') as file:
+            file.write(ROWS[1])
+        self.append(ROWS[0] + '\r\n')
+        self.assert_matches_full_scan()
+
+    def test_unusable_index(self):
+        """ An index file that isn't a JSON object is ignored """
+        for text in ['[]', '0', '"index"']:
+            with open(self.index_file, 'w') as file:
+                file.write(text)
+            with self.assertLogs(level='WARNING'):
+                self.assertIsNone(
+                    incremental_perf.load_index(self.index_file))
+            self.assert_matches_full_scan()
+
+
+class TestGenerateData(TestCase):
+    """ Class for testing the block based data generator """
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.csv')
+        os.close(handle)
+        self.addCleanup(os.remove, self.filename)
+
+    def read_rows(self):
+        """ Parse the generated file with the csv module """
+        with open(self.filename, newline='') as file:
+            return list(csv.reader(file))
+
+    def test_row_layout(self):
+        """ Fast rows have the same layout as get_rand_row() rows """
+        generate_data.write_file_fast(self.filename, 250, block_rows=100)
+        rows = self.read_rows()
+        self.assertEqual(len(rows), 250)
+        for row in rows:
+            self.assertEqual(len(row), 7)
+            self.assertEqual(str(uuid.UUID(row[0])), row[0])
+            for number in row[1:5]:
+                self.assertTrue(1 <= int(number) <= 1000)
+            date = datetime.datetime.strptime(row[5], '%m/%d/%Y').date()
+            self.assertTrue(datetime.date(2012, 1, 2) <= date <=
+                            datetime.date(2022, 1, 7))
+            self.assertIn(row[6], ('', 'ao'))
+
+    def test_seeded_output_repeats(self):
+        """ The same seed writes the same file """
+        generate_data.write_file_fast(self.filename, 50, seed=6)
+        with open(self.filename, 'rb') as file:
+            first = file.read()
+        generate_data.write_file_fast(self.filename, 50, seed=6)
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(file.read(), first)
+
+    def test_sharded(self):
+        """ Part files are concatenated into the full row count """
+        generate_data.write_file_sharded(self.filename, 101, workers=3,
+                                         block_rows=10)
+        self.assertEqual(len(self.read_rows()), 101)
+        directory = os.path.dirname(self.filename)
+        name = os.path.basename(self.filename)
+        self.assertFalse([part for part in os.listdir(directory)
+                          if part.startswith(name + '.part')])
+
+
+class TestBenchmark(TestCase):
+    """ Class for testing the benchmark harness """
+    def test_percentile(self):
+        """ Nearest rank percentiles """
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(benchmark.percentile(values, 95), 5)
+        self.assertEqual(benchmark.percentile(values, 50), 3)
+        self.assertEqual(benchmark.percentile([7], 95), 7)
+
+    def test_regressions(self):
+        """ Only medians slower than the tolerance are reported """
+        previous = [{'implementation': 'a', 'rows': 10, 'median': 1.0},
+                    {'implementation': 'b', 'rows': 10, 'median': 1.0}]
+        results = [{'implementation': 'a', 'rows': 10, 'median': 1.05},
+                   {'implementation': 'b', 'rows': 10, 'median': 1.5},
+                   {'implementation': 'c', 'rows': 10, 'median': 9.0}]
+        self.assertEqual(benchmark.regressions(results, previous, 0.1),
+                         [('b', 10, 1.0, 1.5)])
+
+    def test_run(self):
+        """ Each registered implementation gets a result record """
+        filename = write_rows(ROWS, repeat=10)
+        self.addCleanup(os.remove, filename)
+        implementations = {name: benchmark.IMPLEMENTATIONS[name]
+                           for name in ('poor_perf', 'stream_perf')}
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = benchmark.run([filename], 2, implementations)
+        self.assertEqual([result['implementation'] for result in results],
+                         ['poor_perf', 'stream_perf'])
+        for result in results:
+            self.assertEqual(result['rows'], 60)
+            self.assertEqual(result['runs'], 2)
+            self.assertGreater(result['peak_rss_mib'], 0)
+
+
+class TestAggregate(TestCase):
+    """ Class for testing the declarative aggregation API """
+    def setUp(self):
+        self.filename = write_rows(ROWS, repeat=3)
+        self.addCleanup(os.remove, self.filename)
+
+    def test_matches_good_perf(self):
+        """ analyze() built from metrics returns the good_perf counts """
+        self.assertEqual(quiet(aggregate.analyze, self.filename)[2:],
+                         quiet(good_perf.analyze, self.filename)[2:])
+
+    def test_metrics(self):
+        """ Group by keys, fixed keys, sums and a shared filter """
+        report = aggregate.aggregate(self.filename, {
+            'by_year_flag': aggregate.Count(
+                by=[aggregate.Field(5, start=6), 6]),
+            'fixed_years': aggregate.Count(
+                by=[aggregate.Field(5, start=6)], keys=['2015', '2013']),
+            'sum': aggregate.Sum(1, cast=int),
+            'ao_sum': aggregate.Sum(4, where=[aggregate.Equal(6, 'ao')]),
+            'late': aggregate.Count(
+                where=[aggregate.OneOf(aggregate.Field(5, 0, 2),
+                                       ['12', '08'])])},
+                                     where=[aggregate.Less(1, '6')])
+        self.assertEqual(report['by_year_flag'],
+                         {('2015', ''): 3, ('2011', 'ao'): 3,
+                          ('2017', ''): 3, ('2018', 'xaoy'): 3,
+                          ('2016', 'ao'): 3})
+        self.assertEqual(report['fixed_years'], {'2015': 3, '2013': 0})
+        self.assertEqual(report['sum'], 45)
+        self.assertEqual(report['ao_sum'], 3 * (5.0 + 8.0))
+        self.assertEqual(report['late'], 6)
+
+    def test_single_pass(self):
+        """ All metrics share one loop over the rows """
+        source, _ = aggregate.compile_metrics(
+            [aggregate.Count(where=[aggregate.Contains(6, 'ao')]),
+             aggregate.Count(by=[5]), aggregate.Sum(2)])
+        self.assertEqual(source.count('for '), 1)
+
+    def test_metric_needs_increment(self):
+        """ A metric without an increment cannot be created """
+        # pylint: disable=abstract-method,abstract-class-instantiated
+        class Incomplete(aggregate.Metric):
+            """ A metric that forgot its increment """
+
+        with self.assertRaises(TypeError):
+            Incomplete()